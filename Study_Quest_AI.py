@@ -1,232 +1,503 @@
-from Study_Quest_AI_Functions import read_uploaded_files, generate_questions  # Ensure the function names match exactly
-import streamlit as st
-from dotenv import load_dotenv
-import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import json
-import os
-
-# Initialize API keys
-if "api_keys" not in st.session_state:
-    st.session_state["api_keys"] = {}
-
-is_streamlit_deployed = True  # Set this to True if deployed on Streamlit Cloud
-
-if is_streamlit_deployed:
-    st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"] = st.secrets["GOOGLE_GEN_AI_API_KEY"]
-else:
-    load_dotenv(dotenv_path='cred.env')  # Ensure 'cred.env' is in your project directory
-    st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"] = os.getenv('GOOGLE_GEN_AI_API_KEY')
-
-# Check if the API key was loaded successfully
-if not st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"]:
-    st.error("API key for Google Generative AI not found. Please check your credentials.")
-
-# Center the logo image
-col1, col2, col3 = st.columns(3)
-
-with col1:
-    st.write(' ')
-
-with col2:
-    st.image("Study_Quest_AI_Logo.png", width=200)
-
-with col3:
-    st.write(' ')
-
-st.markdown("<h1 style='text-align: center; color: white;'>Study Quest AI</h1>", unsafe_allow_html=True)
-st.markdown("""
-### Unlock Your Learning Potential with StudyQuest AI!
-Transform your PDFs into interactive quizzes and questionnaires, making memorization and studying easier than ever. Perfect for students aiming to master their subjects, Study Quest AI helps you create customized study materials in just a few clicks.
-**Start your quest for knowledge today!**
-""")
-
-uploaded_files = st.file_uploader("Upload Study Documents", accept_multiple_files=True, type=["pdf", "doc", "docx"], key="file_uploader")
-
-st.markdown("#### Enter the number of questions for each type of test:")
-# Arrange the inputs in a single row using columns
-col1, col2, col3 = st.columns(3)
-
-with col1:
-    multiple_choice = st.number_input("Multiple Choice:", min_value=0, value=1, key='multiple_choice')
-
-with col2:
-    identification = st.number_input("Identification:", min_value=0, value=1, key='identification')
-
-with col3:
-    true_false = st.number_input("True or False:", min_value=0, value=1, key='true_false')
-
-additional_notes = st.text_area("Enter additional notes", height=200, max_chars=200)
-st.write("""
-You can enter additional notes that you would like for the model to consider when picking and creating your questionnaires/quiz.
-- Would you like to use or highlight a more specific topic?
-- Would you like to include dates or locations in the questionnaire?
-""")
-
-
-if 'starting_number' not in st.session_state:
-    st.session_state["starting_number"] = 0
-
-if 'total_questions' not in st.session_state:
-    st.session_state['total_questions'] = 0
-
-if 'questions_progress_bar' not in st.session_state:
-    st.session_state['questions_progress_bar'] = None
-
-if "all_questions" not in st.session_state:
-    st.session_state["all_questions"] = []
-
-if "user_answers" not in st.session_state:
-    st.session_state["user_answers"] = {}
-
-if "edit_mode" not in st.session_state:
-    st.session_state["edit_mode"] = False
-
-if "scoring_history" not in st.session_state:
-    st.session_state["scoring_history"] = {}
-
-# Ensure scoring_history is initialized whenever all_questions is available
-if "all_questions" in st.session_state and st.session_state["all_questions"]:
-    if "scoring_history" not in st.session_state or len(st.session_state["scoring_history"]) != len(st.session_state["all_questions"]):
-        st.session_state["scoring_history"] = {}
-        for idx, question in enumerate(st.session_state["all_questions"]):
-            st.session_state["scoring_history"][idx] = {
-                "question": question,
-                "times_wrong": 0
-            }
-
-if st.button("Generate"):
-    if uploaded_files:
-        st.session_state['total_questions'] = multiple_choice + identification + true_false
-        st.write(f"Total Questions to Generate: {st.session_state['total_questions']}")
-        st.session_state['questions_progress_bar'] = st.progress(0, text="Generating your questions. Please wait..")
-        content = read_uploaded_files(uploaded_files)
-        num_questions = {
-            "multiple_choice": multiple_choice,
-            "identification": identification,
-            "true_false": true_false
-        }
-        all_questions = generate_questions(content, num_questions, additional_note=additional_notes)
-        
-        # Update progress bar to complete
-        st.session_state['questions_progress_bar'].progress(100)
-        st.session_state['questions_progress_bar'].empty()  # Remove the progress bar
-        st.success("Question generation complete!")
-
-        # Initialize scoring history
-        for idx, question in enumerate(all_questions):
-            st.session_state["scoring_history"][idx] = {
-                "question": question,
-                "times_wrong": 0
-            }
-
-        st.session_state["all_questions"] = all_questions
-        st.session_state["user_answers"] = {}
-        st.session_state["edit_mode"] = False
-
-if st.session_state["all_questions"]:
-    st.header("Quiz")
-
-    # Toggle edit mode
-    edit_button_label = "Switch to Edit Mode" if not st.session_state["edit_mode"] else "Exit Edit Mode"
-    if st.button(edit_button_label):
-        st.session_state["edit_mode"] = not st.session_state["edit_mode"]
-
-    # Inform the user about the current mode
-    if st.session_state["edit_mode"]:
-        st.info("You are now in Edit Mode. Make changes to your questions and answers below.")
-    else:
-        st.info("You are in Quiz Mode. Answer the questions and submit your responses.")
-
-    # Begin form only if not in edit mode
-    if not st.session_state["edit_mode"]:
-        with st.form(key='quiz_form'):
-            for idx, question in enumerate(st.session_state["all_questions"]):
-                st.write(f"**Question {idx+1}:**")
-                st.write(question["question"])
-                if question["type_of_test"] == "multiple_choice":
-                    options = [f"{key.upper()}: {val}" for key, val in question["choices"].items()]
-                    answer = st.radio("Choose an option:", options=options, key=f"answer_{idx}")
-                    st.session_state["user_answers"][idx] = answer.split(":")[0].strip().lower()
-                elif question["type_of_test"] == "true_false":
-                    answer = st.radio("Choose True or False:", options=["True", "False"], key=f"answer_{idx}")
-                    st.session_state["user_answers"][idx] = True if answer == "True" else False
-                elif question["type_of_test"] == "identification":
-                    answer = st.text_input("Your Answer:", key=f"answer_{idx}")
-                    st.session_state["user_answers"][idx] = answer
-
-            submit_button = st.form_submit_button(label='Submit')
-
-        # Inside the result processing after submit_button is clicked
-        if submit_button:
-            st.header("Results")
-            score = 0
-            total = len(st.session_state["all_questions"])
-            for idx, question in enumerate(st.session_state["all_questions"]):
-                user_answer = st.session_state["user_answers"].get(idx, None)
-                correct = False
-                # Code to check if the answer is correct
-                if question["type_of_test"] == "multiple_choice":
-                    correct_answer = question["answer"]
-                    if user_answer == correct_answer:
-                        correct = True
-                elif question["type_of_test"] == "true_false":
-                    correct_answer = question["answer"]
-                    if user_answer == correct_answer:
-                        correct = True
-                elif question["type_of_test"] == "identification":
-                    correct_answer = question["answer"].strip().lower()
-                    if user_answer.strip().lower() == correct_answer:
-                        correct = True
-                if correct:
-                    st.write(f"Question {idx+1}: Correct ✅")
-                    score += 1
-                else:
-                    st.write(f"Question {idx+1}: Incorrect ❌")
-                    st.write(f"Your Answer: {user_answer}")
-                    st.write(f"Correct Answer: {question['answer']}")
-                    # Update scoring history
-                    if idx in st.session_state["scoring_history"]:
-                        st.session_state["scoring_history"][idx]["times_wrong"] += 1
-                    else:
-                        st.session_state["scoring_history"][idx] = {
-                            "question": question,
-                            "times_wrong": 1
-                        }
-            st.write(f"**Your Score: {score} out of {total}**")
-    else:
-        # Editing mode
-        for idx, question in enumerate(st.session_state["all_questions"]):
-            st.write(f"**Question {idx+1}:**")
-            question_text = st.text_area(f"Edit Question {idx+1}", value=question["question"], key=f"edit_question_{idx}")
-            question["question"] = question_text
-            if question["type_of_test"] == "multiple_choice":
-                for choice_key in ["a", "b", "c", "d"]:
-                    choice_text = st.text_input(f"Choice {choice_key.upper()} for Question {idx+1}", value=question["choices"][choice_key], key=f"edit_choice_{choice_key}_{idx}")
-                    question["choices"][choice_key] = choice_text
-                correct_answer = st.selectbox(f"Correct Answer for Question {idx+1}", options=["a", "b", "c", "d"], index=["a", "b", "c", "d"].index(question["answer"]), key=f"edit_correct_{idx}")
-                question["answer"] = correct_answer
-            elif question["type_of_test"] == "true_false":
-                correct_answer = st.selectbox(f"Correct Answer for Question {idx+1}", options=["True", "False"], index=0 if question["answer"] == True else 1, key=f"edit_correct_tf_{idx}")
-                question["answer"] = True if correct_answer == "True" else False
-            elif question["type_of_test"] == "identification":
-                correct_answer = st.text_input(f"Correct Answer for Question {idx+1}", value=question["answer"], key=f"edit_correct_id_{idx}")
-                question["answer"] = correct_answer
-
-    # Export questions and scoring history
-    if st.button("Export Questions and Scoring History"):
-        export_data = {
-            "questions": st.session_state["all_questions"],
-            "scoring_history": st.session_state["scoring_history"]
-        }
-        json_data = json.dumps(export_data, indent=4)
-        st.download_button(label="Download JSON", data=json_data, file_name="questions_and_history.json", mime="application/json")
-
-    # Import questions and scoring history
-    imported_file = st.file_uploader("Import Questions and Scoring History", type=["json"], key="import_file")
-    if imported_file is not None:
-        imported_data = json.load(imported_file)
-        st.session_state["all_questions"] = imported_data.get("questions", [])
-        st.session_state["scoring_history"] = imported_data.get("scoring_history", {})
-        st.success("Questions and scoring history imported successfully!")
+from Study_Quest_AI_Functions import GenerationCancelled, read_uploaded_files  # Ensure the function names match exactly
+from Study_Quest_AI_Jobs import GenerationJobRunning, cancel_generation_job, start_generation_job
+from Study_Quest_AI_Metrics import Instrumentation, recording
+from Study_Quest_AI_Dedup import find_near_duplicates
+from Study_Quest_AI_Review import ReviewScheduler
+from Study_Quest_AI_Store import get_question_store
+from Study_Quest_AI_Export import import_bank, iter_export_lines, write_bank_export
+from Study_Quest_AI_Bank import QuestionBank, forget_shared_bank, make_question_bank, open_shared_bank, share_bank
+import streamlit as st
+from dotenv import load_dotenv
+import time
+import gzip
+import zlib
+import uuid
+import math
+import io
+import os
+
+# Initialize API keys
+if "api_keys" not in st.session_state:
+    st.session_state["api_keys"] = {}
+
+is_streamlit_deployed = True  # Set this to True if deployed on Streamlit Cloud
+
+if is_streamlit_deployed:
+    st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"] = st.secrets["GOOGLE_GEN_AI_API_KEY"]
+else:
+    load_dotenv(dotenv_path='cred.env')  # Ensure 'cred.env' is in your project directory
+    st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"] = os.getenv('GOOGLE_GEN_AI_API_KEY')
+
+# Check if the API key was loaded successfully
+if not st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"]:
+    st.error("API key for Google Generative AI not found. Please check your credentials.")
+
+# Center the logo image
+col1, col2, col3 = st.columns(3)
+
+with col1:
+    st.write(' ')
+
+with col2:
+    st.image("Study_Quest_AI_Logo.png", width=200)
+
+with col3:
+    st.write(' ')
+
+st.markdown("<h1 style='text-align: center; color: white;'>Study Quest AI</h1>", unsafe_allow_html=True)
+st.markdown("""
+### Unlock Your Learning Potential with StudyQuest AI!
+Transform your PDFs into interactive quizzes and questionnaires, making memorization and studying easier than ever. Perfect for students aiming to master their subjects, Study Quest AI helps you create customized study materials in just a few clicks.
+**Start your quest for knowledge today!**
+""")
+
+uploaded_files = st.file_uploader("Upload Study Documents", accept_multiple_files=True, type=["pdf", "doc", "docx"], key="file_uploader")
+
+st.markdown("#### Enter the number of questions for each type of test:")
+# Arrange the inputs in a single row using columns
+col1, col2, col3 = st.columns(3)
+
+with col1:
+    multiple_choice = st.number_input("Multiple Choice:", min_value=0, value=1, key='multiple_choice')
+
+with col2:
+    identification = st.number_input("Identification:", min_value=0, value=1, key='identification')
+
+with col3:
+    true_false = st.number_input("True or False:", min_value=0, value=1, key='true_false')
+
+additional_notes = st.text_area("Enter additional notes", height=200, max_chars=200)
+st.write("""
+You can enter additional notes that you would like for the model to consider when picking and creating your questionnaires/quiz.
+- Would you like to use or highlight a more specific topic?
+- Would you like to include dates or locations in the questionnaire?
+""")
+
+fresh_questions = st.checkbox("Generate fresh questions", value=False, help="Skip previously generated questions for the same documents and settings and ask the model again.")
+strip_boilerplate = st.checkbox("Strip headers, footers and references", value=True, help="Leave out page numbers, running headers/footers and a trailing reference list before sending the text to the model.")
+source_text_kept = st.slider("Source text kept (%)", min_value=20, max_value=100, value=100, step=5, help="Below 100, only the most informative sentences of each chunk are sent to the model, which uses fewer tokens.")
+record_diagnostics = st.checkbox("Record diagnostics", value=False, help="Time each stage of the generation and show where the seconds went.")
+
+
+# Identifies this browser session to the shared request scheduler, which takes turns across sessions
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
+# Saved banks are only listed for, and deletable by, the owner that saved them. The owner id is kept in the
+# page URL, so a reload or a bookmark of that URL finds the same banks
+if "owner" not in st.query_params:
+    st.query_params["owner"] = uuid.uuid4().hex
+owner_id = st.query_params["owner"]
+
+if 'starting_number' not in st.session_state:
+    st.session_state["starting_number"] = 0
+
+if 'total_questions' not in st.session_state:
+    st.session_state['total_questions'] = 0
+
+if "all_questions" not in st.session_state:
+    st.session_state["all_questions"] = QuestionBank()
+
+if "user_answers" not in st.session_state:
+    st.session_state["user_answers"] = {}
+
+if "edit_mode" not in st.session_state:
+    st.session_state["edit_mode"] = False
+
+if "scoring_history" not in st.session_state:
+    st.session_state["scoring_history"] = {}
+
+# scoring_history only holds entries for questions with a result, keyed by their index in all_questions,
+# so nothing has to be rebuilt to keep it in step with the questions
+
+question_store = get_question_store()
+
+if "bank_id" not in st.session_state:
+    st.session_state["bank_id"] = None
+
+with st.sidebar:
+    st.header("Saved question banks")
+    saved_banks = question_store.list_banks(owner_id)
+    if saved_banks:
+        bank_labels = {bank_id: f"{name} - {question_count} questions" for bank_id, name, _, question_count in saved_banks}
+        selected_bank_id = st.selectbox("Question bank", options=list(bank_labels), format_func=bank_labels.get)
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Open"):
+                # Sessions with the same bank open share its questions and only keep their own history
+                st.session_state["all_questions"] = open_shared_bank(question_store, selected_bank_id)
+                st.session_state["scoring_history"] = question_store.load_history(selected_bank_id)
+                st.session_state["bank_id"] = selected_bank_id
+                st.session_state["user_answers"] = {}
+                st.session_state["question_page"] = 0
+                st.session_state["edit_mode"] = False
+        with col2:
+            if st.button("Delete"):
+                if question_store.delete_bank(selected_bank_id, owner_id):
+                    forget_shared_bank(selected_bank_id)
+                if st.session_state["bank_id"] == selected_bank_id:
+                    st.session_state["bank_id"] = None
+                st.rerun()
+    else:
+        st.write("Generated questions are saved here.")
+
+if "generation_job" not in st.session_state:
+    st.session_state["generation_job"] = None
+
+if "generation_notice" not in st.session_state:
+    st.session_state["generation_notice"] = None
+
+if st.button("Generate", disabled=st.session_state["generation_job"] is not None):
+    if uploaded_files:
+        st.session_state['total_questions'] = multiple_choice + identification + true_false
+        # recording(None) leaves instrumentation off, which costs next to nothing
+        diagnostics = Instrumentation() if record_diagnostics else None
+        token_report = {}
+        sources = []
+        with recording(diagnostics):
+            content = read_uploaded_files(uploaded_files, strip_boilerplate=strip_boilerplate, token_report=token_report, sources=sources)
+        num_questions = {
+            "multiple_choice": multiple_choice,
+            "identification": identification,
+            "true_false": true_false
+        }
+
+        st.session_state["starting_number"] = 1
+        # Generation runs as a background job, so reruns and reconnects no longer throw away finished chunks.
+        # Pressing Generate again for the same documents and settings resumes an interrupted job
+        try:
+            with recording(diagnostics):
+                st.session_state["generation_job"] = start_generation_job(content, num_questions, additional_note=additional_notes, fresh=fresh_questions,
+                                                                          api_key=st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"], starting_question_number=st.session_state["starting_number"],
+                                                                          session_id=st.session_state["session_id"], compression_ratio=source_text_kept / 100, sources=sources)
+        except GenerationJobRunning:
+            if fresh_questions:
+                st.session_state["generation_notice"] = ("warning", "The same documents are already being generated with these settings. Wait for that to finish, or generate without fresh questions to follow it.")
+            else:
+                st.session_state["generation_notice"] = ("warning", "The cancelled generation of these documents is still stopping. Press Generate again in a moment to pick up where it stopped.")
+        else:
+            st.session_state["extraction_token_report"] = token_report
+            st.session_state["pending_bank_name"] = ", ".join(file.name for file in uploaded_files)
+            st.session_state["diagnostics"] = diagnostics
+            st.session_state["generation_notice"] = None
+        st.rerun()
+
+
+@st.fragment(run_every=1)
+def show_generation_progress():
+    job = st.session_state["generation_job"]
+    progress = job.progress()
+    if not job.done:
+        st.write(f"Total Questions to Generate: {st.session_state['total_questions']}")
+        if progress["chunks_total"]:
+            chunk_text = f"{progress['chunks_done']} of {progress['chunks_total']} parts done"
+            if progress["chunks_reused"]:
+                chunk_text += f", {progress['chunks_reused']} resumed from an earlier run"
+            st.progress(progress["chunks_done"] / progress["chunks_total"], text=f"Generated {progress['questions']} of {st.session_state['total_questions']} questions ({chunk_text}). Please wait..")
+        else:
+            st.progress(0, text="Generating your questions. Please wait..")
+        # Questions arrive in completion order; the final list is re-ordered by chunk once generation ends
+        for question_number, question in enumerate(job.questions[-5:], start=max(1, len(job.questions) - 4)):
+            st.write(f"**Generated question {question_number}:** {question.get('question', '')}")
+        if st.button("Cancel generation"):
+            cancel_generation_job(job)
+            st.session_state["generation_job"] = None
+            st.session_state["generation_notice"] = ("warning", "Generation cancelled. Finished parts are kept, so generating again with the same settings picks up where it stopped.")
+            st.rerun()
+        return
+
+    st.session_state["generation_job"] = None
+    try:
+        all_questions = job.get_result()
+    except GenerationCancelled:
+        st.session_state["generation_notice"] = ("warning", "Generation cancelled. Finished parts are kept, so generating again with the same settings picks up where it stopped.")
+        st.rerun()
+    except Exception as e:
+        st.session_state["generation_notice"] = ("error", f"Generation stopped after {progress['chunks_done']} of {progress['chunks_total'] or 0} parts: {e}. Press Generate again to retry only the unfinished parts.")
+        st.rerun()
+
+    token_report = {**st.session_state.get("extraction_token_report", {}), **job.token_report}
+    notice = "Question generation complete!"
+    tokens_saved = token_report.get("boilerplate_tokens_saved", 0) + token_report.get("compression_tokens_saved", 0)
+    if tokens_saved:
+        notice += f" Sent about {token_report.get('input_tokens', 0):,} tokens of source text, {tokens_saved:,} fewer than the uploaded documents."
+    st.session_state["generation_notice"] = ("success", notice)
+
+    # Every generated bank is saved; edits and graded answers are then written back one question at a time
+    def save_generated_bank():
+        bank_id = uuid.uuid4().hex
+        bank_name = st.session_state.get("pending_bank_name") or "Generated questions"
+        questions = make_question_bank({"source": bank_name, **question} for question in all_questions)
+        question_store.create_bank(bank_id, f"{bank_name} ({time.strftime('%Y-%m-%d %H:%M')})", owner=owner_id)
+        question_store.replace_bank(bank_id, questions)
+        share_bank(bank_id, questions)
+        return bank_id
+
+    # Sessions that joined the same job open the bank the first of them saved
+    bank_id = job.save_bank(owner_id, save_generated_bank)
+
+    st.session_state["all_questions"] = open_shared_bank(question_store, bank_id)
+    st.session_state["scoring_history"] = {}
+    st.session_state["user_answers"] = {}
+    st.session_state["question_page"] = 0
+    st.session_state["bank_id"] = bank_id
+    st.session_state["edit_mode"] = False
+    st.rerun()
+
+
+if st.session_state["generation_job"] is not None:
+    show_generation_progress()
+
+if st.session_state["generation_notice"] is not None:
+    notice_kind, notice_text = st.session_state["generation_notice"]
+    getattr(st, notice_kind)(notice_text)
+
+if st.session_state.get("diagnostics") is not None:
+    with st.expander("Diagnostics"):
+        diagnostics = st.session_state["diagnostics"]
+        st.dataframe(diagnostics.summary())
+        st.json(diagnostics.counters)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(label="Download JSON Lines", data=diagnostics.to_json_lines(), file_name="diagnostics.jsonl", mime="application/json")
+        with col2:
+            st.download_button(label="Download Prometheus Metrics", data=diagnostics.to_prometheus(), file_name="diagnostics.prom", mime="text/plain")
+
+QUESTIONS_PER_PAGE = 10
+
+if "question_page" not in st.session_state:
+    st.session_state["question_page"] = 0
+
+
+def change_question_page(step):
+    st.session_state["question_page"] += step
+
+
+QUESTION_TYPE_LABELS = {
+    "multiple_choice": "Multiple Choice",
+    "identification": "Identification",
+    "true_false": "True or False"
+}
+
+
+def question_page_indexes():
+    # Shows the filters and page navigation and returns the question indexes on the current page.
+    # Saved banks are filtered and paged with indexed queries; unsaved ones (e.g. imports) in memory
+    type_filter = st.selectbox("Show", options=[None, *QUESTION_TYPE_LABELS], format_func=lambda value: "All questions" if value is None else QUESTION_TYPE_LABELS[value], key="question_type_filter")
+    bank_id = st.session_state["bank_id"]
+    if bank_id is not None:
+        sources = question_store.sources(bank_id)
+    else:
+        sources = sorted({question["source"] for question in st.session_state["all_questions"] if "source" in question})
+    # The source filter only appears for banks built from more than one document
+    source_filter = None
+    if len(sources) > 1:
+        if st.session_state.get("question_source_filter") not in sources:
+            st.session_state["question_source_filter"] = None
+        source_filter = st.selectbox("From", options=[None, *sources], format_func=lambda value: "All documents" if value is None else value, key="question_source_filter")
+    if bank_id is not None:
+        total = question_store.count(bank_id, type_of_test=type_filter, source=source_filter)
+    else:
+        matching_indexes = [idx for idx, question in enumerate(st.session_state["all_questions"])
+                            if (type_filter is None or question["type_of_test"] == type_filter) and (source_filter is None or question.get("source") == source_filter)]
+        total = len(matching_indexes)
+    page_count = max(1, math.ceil(total / QUESTIONS_PER_PAGE))
+    page = min(max(st.session_state["question_page"], 0), page_count - 1)
+    st.session_state["question_page"] = page
+    if page_count > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("Previous", on_click=change_question_page, args=(-1,), disabled=page == 0, key="previous_question_page")
+        with col2:
+            st.write(f"Page {page + 1} of {page_count}")
+        with col3:
+            st.button("Next", on_click=change_question_page, args=(1,), disabled=page == page_count - 1, key="next_question_page")
+    if bank_id is not None:
+        return question_store.page_positions(bank_id, page * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE, type_of_test=type_filter, source=source_filter)
+    return matching_indexes[page * QUESTIONS_PER_PAGE:(page + 1) * QUESTIONS_PER_PAGE]
+
+
+def get_review_scheduler():
+    # Rebuilt only when scoring_history is replaced or grown by a new generation, an open or an import
+    scheduler = st.session_state.get("review_scheduler")
+    if scheduler is None or scheduler.scoring_history is not st.session_state["scoring_history"] or scheduler.question_count != len(st.session_state["all_questions"]):
+        scheduler = ReviewScheduler(st.session_state["scoring_history"], len(st.session_state["all_questions"]))
+        st.session_state["review_scheduler"] = scheduler
+        st.session_state["review_batch"] = None
+    return scheduler
+
+
+@st.fragment
+def show_quiz_page(question_indexes=None):
+    if question_indexes is None:
+        question_indexes = question_page_indexes()
+    st.session_state["shown_question_indexes"] = list(question_indexes)
+    # Widgets are keyed by the grading round, so each Submit gives them fresh state filled from user_answers
+    answer_round = st.session_state.get("answer_round", 0)
+    for idx in question_indexes:
+        question = st.session_state["all_questions"][idx]
+        user_answer = st.session_state["user_answers"].get(idx)
+        st.write(f"**Question {idx+1}:**")
+        st.write(question["question"])
+        if question["type_of_test"] == "multiple_choice":
+            choice_keys = list(question["choices"].keys())
+            options = [f"{key.upper()}: {val}" for key, val in question["choices"].items()]
+            answer = st.radio("Choose an option:", options=options, index=choice_keys.index(user_answer) if user_answer in choice_keys else None, key=f"answer_{idx}_{answer_round}")
+            if answer is not None:
+                st.session_state["user_answers"][idx] = answer.split(":")[0].strip().lower()
+        elif question["type_of_test"] == "true_false":
+            answer = st.radio("Choose True or False:", options=["True", "False"], index=None if user_answer is None else (0 if user_answer else 1), key=f"answer_{idx}_{answer_round}")
+            if answer is not None:
+                st.session_state["user_answers"][idx] = True if answer == "True" else False
+        elif question["type_of_test"] == "identification":
+            answer = st.text_input("Your Answer:", value=user_answer or "", key=f"answer_{idx}_{answer_round}")
+            st.session_state["user_answers"][idx] = answer
+
+
+@st.fragment
+def show_edit_page():
+    for idx in question_page_indexes():
+        question = st.session_state["all_questions"][idx]
+        original_question = question.to_dict()
+        st.write(f"**Question {idx+1}:**")
+        question_text = st.text_area(f"Edit Question {idx+1}", value=question["question"], key=f"edit_question_{idx}")
+        question["question"] = question_text
+        if question["type_of_test"] == "multiple_choice":
+            for choice_key in ["a", "b", "c", "d"]:
+                choice_text = st.text_input(f"Choice {choice_key.upper()} for Question {idx+1}", value=question["choices"][choice_key], key=f"edit_choice_{choice_key}_{idx}")
+                question["choices"][choice_key] = choice_text
+            correct_answer = st.selectbox(f"Correct Answer for Question {idx+1}", options=["a", "b", "c", "d"], index=["a", "b", "c", "d"].index(question["answer"]), key=f"edit_correct_{idx}")
+            question["answer"] = correct_answer
+        elif question["type_of_test"] == "true_false":
+            correct_answer = st.selectbox(f"Correct Answer for Question {idx+1}", options=["True", "False"], index=0 if question["answer"] == True else 1, key=f"edit_correct_tf_{idx}")
+            question["answer"] = True if correct_answer == "True" else False
+        elif question["type_of_test"] == "identification":
+            correct_answer = st.text_input(f"Correct Answer for Question {idx+1}", value=question["answer"], key=f"edit_correct_id_{idx}")
+            question["answer"] = correct_answer
+        if st.session_state["bank_id"] is not None and question.to_dict() != original_question:
+            question_store.upsert_question(st.session_state["bank_id"], idx, question)
+
+
+if st.session_state["all_questions"]:
+    st.header("Quiz")
+
+    # Toggle edit mode
+    edit_button_label = "Switch to Edit Mode" if not st.session_state["edit_mode"] else "Exit Edit Mode"
+    if st.button(edit_button_label):
+        st.session_state["edit_mode"] = not st.session_state["edit_mode"]
+
+    review_mode = not st.session_state["edit_mode"] and st.toggle("Review due questions", key="review_mode", help="Only show the questions spaced repetition says are due, starting with the ones you miss most.")
+
+    # Inform the user about the current mode
+    if st.session_state["edit_mode"]:
+        st.info("You are now in Edit Mode. Make changes to your questions and answers below.")
+    elif review_mode:
+        st.info("You are in Review Mode. Answer the questions that are due and submit to schedule their next review.")
+    else:
+        st.info("You are in Quiz Mode. Answer the questions and submit your responses.")
+
+    # Only the visible page builds widgets, and its widgets rerun only their fragment, so large banks stay responsive.
+    # Answers and edits are written straight into session state, so they survive paging away and back
+    if not st.session_state["edit_mode"]:
+        review_batch = None
+        if review_mode:
+            review_scheduler = get_review_scheduler()
+            if st.session_state.get("review_batch") is None:
+                st.session_state["review_batch"] = review_scheduler.due_questions(QUESTIONS_PER_PAGE)
+            review_batch = st.session_state["review_batch"]
+            if review_batch:
+                st.caption(f"{review_scheduler.due_count()} of {len(review_scheduler)} questions due for review.")
+            else:
+                next_due_time = review_scheduler.next_due_time()
+                st.success("Nothing is due right now." + (f" Next review {time.strftime('%Y-%m-%d %H:%M', time.gmtime(next_due_time))} UTC." if next_due_time is not None else ""))
+
+        if review_batch is None:
+            show_quiz_page()
+        elif review_batch:
+            show_quiz_page(review_batch)
+        submit_button = st.button("Submit", disabled=review_batch == [])
+
+        # Inside the result processing after submit_button is clicked
+        if submit_button:
+            from Study_Quest_AI_Grading import grade_attempt  # pandas is only loaded once there is something to grade
+            st.header("Results")
+            # Only answered questions are graded; the rest of what is on screen is listed as not attempted and keeps its history
+            shown_indexes = review_batch or st.session_state.get("shown_question_indexes", [])
+            answered_indexes = sorted(idx for idx, answer in st.session_state["user_answers"].items()
+                                      if answer is not None and answer != "" and (not review_batch or idx in review_batch))
+            if not answered_indexes:
+                st.warning("Answer at least one question before submitting.")
+            else:
+                graded = grade_attempt(st.session_state["all_questions"], st.session_state["user_answers"], question_indexes=answered_indexes)
+                # DataFrame indexes come back as numpy integers, scoring_history is keyed by int
+                results = {int(idx): (user_answer, bool(correct)) for idx, user_answer, correct in zip(graded["question_index"], graded["user_answer"], graded["correct"])}
+                for idx in sorted(set(shown_indexes) | set(results)):
+                    question = st.session_state["all_questions"][idx]
+                    if idx not in results:
+                        st.write(f"Question {idx+1}: Not attempted")
+                        continue
+                    user_answer, correct = results[idx]
+                    if correct:
+                        st.write(f"Question {idx+1}: Correct ✅")
+                    else:
+                        st.write(f"Question {idx+1}: Incorrect ❌")
+                        st.write(f"Your Answer: {user_answer}")
+                        st.write(f"Correct Answer: {question['answer']}")
+                        # Update scoring history
+                        history_entry = st.session_state["scoring_history"].setdefault(idx, {"times_wrong": 0})
+                        history_entry["times_wrong"] += 1
+                st.write(f"**Your Score: {sum(correct for _, correct in results.values())} out of {len(results)}**")
+                # Every graded answer reschedules its question, whether it was answered in a quiz or a review
+                get_review_scheduler().record_graded(graded)
+                st.session_state["review_batch"] = None
+                # Every answer is graded once: graded answers are cleared, so submitting again does not reschedule
+                # the same attempt twice, and the next page or due batch starts blank
+                for idx in set(results) | set(review_batch or []):
+                    st.session_state["user_answers"].pop(idx, None)
+                st.session_state["answer_round"] = st.session_state.get("answer_round", 0) + 1
+                if st.session_state["bank_id"] is not None:
+                    question_store.update_history(st.session_state["bank_id"], {idx: st.session_state["scoring_history"][idx] for idx in results if idx in st.session_state["scoring_history"]})
+                if review_batch:
+                    st.button("Next due questions")
+    else:
+        show_edit_page()
+
+    # Export questions and scoring history
+    if st.button("Export Questions and Scoring History"):
+        # Streamed as compressed JSON lines, straight from the store when the bank is saved
+        if st.session_state["bank_id"] is not None:
+            export_lines = iter_export_lines(question_store.iter_bank(st.session_state["bank_id"]), {})
+        else:
+            export_lines = iter_export_lines(st.session_state["all_questions"], st.session_state["scoring_history"])
+        export_file = io.BytesIO()
+        write_bank_export(export_lines, export_file)
+        st.download_button(label="Download Question Bank", data=export_file.getvalue(), file_name="questions_and_history.jsonl.gz", mime="application/gzip")
+
+# Import questions and scoring history
+imported_file = st.file_uploader("Import Questions and Scoring History", type=["jsonl", "gz", "json"], key="import_file",
+                                 help="A question bank export, batch output or an older JSON export. Imported questions are added to the open bank.")
+if "imported_file_ids" not in st.session_state:
+    st.session_state["imported_file_ids"] = set()
+# The uploader keeps its file across reruns, so each upload is merged only once
+if imported_file is not None and imported_file.file_id not in st.session_state["imported_file_ids"]:
+    if st.session_state["bank_id"] is None:
+        bank_id = uuid.uuid4().hex
+        question_store.create_bank(bank_id, f"{imported_file.name} ({time.strftime('%Y-%m-%d %H:%M')})", owner=owner_id)
+        question_store.replace_bank(bank_id, st.session_state["all_questions"], scoring_history=st.session_state["scoring_history"])
+        st.session_state["bank_id"] = bank_id
+    first_new_question = len(st.session_state["all_questions"])
+    try:
+        import_report = import_bank(imported_file, st.session_state["all_questions"], st.session_state["scoring_history"], question_store, st.session_state["bank_id"])
+    except (ValueError, EOFError, gzip.BadGzipFile, zlib.error, OSError) as e:
+        # import_bank rolled back whatever it had merged, and the upload stays unmarked so it can be tried again
+        st.error(f"Could not import {imported_file.name}: {e}")
+    else:
+        st.session_state["imported_file_ids"].add(imported_file.file_id)
+        notice = f"Imported {import_report['imported']} questions ({import_report['duplicates']} already in the bank, {import_report['invalid']} invalid)."
+        if import_report["imported"]:
+            near_duplicates = [(idx, original_idx) for idx, original_idx in find_near_duplicates(st.session_state["all_questions"]) if idx >= first_new_question]
+            if near_duplicates:
+                duplicate_numbers = ", ".join(f"{idx + 1} (repeats {original_idx + 1})" for idx, original_idx in near_duplicates[:20])
+                notice += f" Found {len(near_duplicates)} near-duplicate questions: {duplicate_numbers}"
+        st.session_state["generation_notice"] = ("success", notice)
+        st.rerun()
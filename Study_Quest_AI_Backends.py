@@ -0,0 +1,126 @@
+"""Model backends usable in place of a Gemini GenerativeModel.
+
+A backend exposes the same generate_content(prompt, stream=False) surface the pipeline already uses for
+Gemini: the result has .text and .usage_metadata, and with stream=True it is an iterator of such pieces.
+OllamaBackend talks to an Ollama-compatible server, so generation can run fully on-premises.
+"""
+from abc import ABC, abstractmethod
+import threading
+import json
+import os
+
+
+OLLAMA_URL = os.getenv("STUDY_QUEST_OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("STUDY_QUEST_OLLAMA_MODEL", "llama3")
+OLLAMA_CONTEXT_TOKENS = int(os.getenv("STUDY_QUEST_OLLAMA_CONTEXT_TOKENS", "8192"))
+SYSTEM_PROMPT = "You are tasked to create questions based on a specific content/text for students that are trying to study."
+
+# Connect quickly or fail, but give a CPU-bound local model time to finish a long completion
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 300
+
+
+class UsageMetadata:
+    def __init__(self, prompt_token_count=0, candidates_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class BackendResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class ModelBackend(ABC):
+    """Base class for model backends.
+
+    context_tokens is how much prompt plus completion a single request may hold.
+    """
+
+    name = "backend"
+    context_tokens = 8192
+
+    @abstractmethod
+    def generate_content(self, prompt, stream=False):
+        pass
+
+
+class OllamaBackend(ModelBackend):
+    """Ollama /api/chat client over one pooled requests.Session.
+
+    Connection failures are retried a bounded number of times by the adapter. Completions are never
+    resent after a read timeout, so a stuck server costs at most one READ_TIMEOUT per request.
+    HTTP errors are raised for the caller's scheduler to back off on.
+    """
+
+    name = "ollama"
+
+    def __init__(self, model=OLLAMA_MODEL, base_url=OLLAMA_URL, context_tokens=OLLAMA_CONTEXT_TOKENS, system_prompt=SYSTEM_PROMPT,
+                 pool_size=8, max_connect_retries=3, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.model = model
+        self.base_url = base_url.rstrip("/")
+        self.context_tokens = context_tokens
+        self.system_prompt = system_prompt
+        self.timeout = timeout
+        # Deferred so the Gemini path never pays for importing requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        import requests
+        retry = Retry(total=max_connect_retries, connect=max_connect_retries, read=0, status=0, backoff_factor=0.5, allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request_body(self, prompt, stream):
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": stream,
+            "options": {"num_ctx": self.context_tokens}
+        }
+
+    @staticmethod
+    def _usage(body):
+        return UsageMetadata(body.get("prompt_eval_count", 0) or 0, body.get("eval_count", 0) or 0)
+
+    def generate_content(self, prompt, stream=False):
+        response = self.session.post(f"{self.base_url}/api/chat", json=self._request_body(prompt, stream), timeout=self.timeout, stream=stream)
+        response.raise_for_status()
+        if not stream:
+            body = response.json()
+            return BackendResponse(body["message"]["content"], self._usage(body))
+        return self._stream(response)
+
+    def _stream(self, response):
+        # Ollama streams one JSON object per line; the last one carries done=true and the token counts
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                body = json.loads(line)
+                usage = self._usage(body) if body.get("done") else None
+                yield BackendResponse(body.get("message", {}).get("content", ""), usage)
+
+    def close(self):
+        self.session.close()
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_ollama_backend(model=OLLAMA_MODEL, base_url=OLLAMA_URL):
+    # One backend, and so one connection pool, per server and model for the whole process
+    key = (base_url, model)
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = OllamaBackend(model=model, base_url=base_url)
+            _backends[key] = backend
+        return backend
@@ -0,0 +1,102 @@
+"""Compact in-memory question banks.
+
+Sessions keep their questions as slotted Question records instead of dicts; repeated strings (question
+types, sources, numbers) are interned. A Question still answers question["answer"], .get() and ** like
+the dicts the rest of the code was written against. A bank opened from the store is loaded once and
+shared by every session that has it open, and scoring history refers to questions by their position
+in the bank instead of carrying them.
+"""
+import threading
+import weakref
+import sys
+
+
+class Question:
+    __slots__ = ("question", "type_of_test", "choices", "answer", "question_number", "source")
+
+    def __init__(self, question, type_of_test, answer, choices=None, question_number=None, source=None):
+        self.question = question
+        self.type_of_test = sys.intern(type_of_test)
+        self.answer = answer
+        self.choices = choices
+        self.question_number = None if question_number is None else sys.intern(str(question_number))
+        self.source = None if source is None else sys.intern(source)
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, cls):
+            return data
+        return cls(data["question"], data["type_of_test"], data["answer"], data.get("choices"), data.get("question_number"), data.get("source"))
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+        if self.choices is not None:
+            data["choices"] = dict(self.choices)
+        return data
+
+    # Mapping interface, so code handling question dicts handles records too
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def keys(self):
+        return [field for field in self.__slots__ if getattr(self, field) is not None]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, (Question, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Question) else other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Question({self.to_dict()!r})"
+
+
+class QuestionBank(list):
+    """List of Question records; a list subclass so shared banks can be tracked by weak reference."""
+
+
+def make_question_bank(questions):
+    return QuestionBank(Question.from_dict(question) for question in questions)
+
+
+_shared_banks = weakref.WeakValueDictionary()
+_shared_banks_lock = threading.Lock()
+
+
+def open_shared_bank(store, bank_id):
+    # All sessions with the same saved bank open hold the same QuestionBank; it is dropped when the last one lets go.
+    # Edits and imports go to both this object and the store, so every session sees them
+    with _shared_banks_lock:
+        questions = _shared_banks.get(bank_id)
+        if questions is None:
+            questions = QuestionBank(question for _, question, _ in store.iter_bank(bank_id))
+            _shared_banks[bank_id] = questions
+        return questions
+
+
+def share_bank(bank_id, questions):
+    with _shared_banks_lock:
+        _shared_banks[bank_id] = questions
+
+
+def forget_shared_bank(bank_id):
+    with _shared_banks_lock:
+        _shared_banks.pop(bank_id, None)
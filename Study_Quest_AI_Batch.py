@@ -0,0 +1,177 @@
+"""Headless batch generation of question banks.
+
+Walks a directory of study documents, generates questions for each one and appends them to a JSONL file.
+Progress is recorded next to the output, so an interrupted run picks up where it stopped:
+
+    python Study_Quest_AI_Batch.py course_documents/ question_bank.jsonl --multiple-choice 10 --identification 5 --true-false 5
+"""
+from Study_Quest_AI_Extraction import PDF_MIME_TYPE, WORD_MIME_TYPES, document_hash, iter_document_pages
+from Study_Quest_AI_Functions import MAX_CONCURRENT_REQUESTS, generate_questions, get_api_key, strip_page_furniture
+from Study_Quest_AI_Metrics import Instrumentation, recording
+from Study_Quest_AI_Cache import make_cache_key
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import Study_Quest_AI_Metrics as metrics
+import contextvars
+import threading
+import argparse
+import json
+import sys
+import os
+
+
+FILE_TYPES_BY_EXTENSION = {
+    ".pdf": PDF_MIME_TYPE,
+    ".doc": WORD_MIME_TYPES[0],
+    ".docx": WORD_MIME_TYPES[1]
+}
+
+
+def find_documents(input_dir):
+    documents = []
+    for root, _, file_names in os.walk(input_dir):
+        for file_name in file_names:
+            file_type = FILE_TYPES_BY_EXTENSION.get(os.path.splitext(file_name)[1].lower())
+            if file_type is not None:
+                documents.append((os.path.join(root, file_name), file_type))
+    documents.sort()
+    return documents
+
+
+def completion_key(doc_hash, num_questions, additional_note, compression_ratio):
+    # A document counts as done only for the settings it was generated with
+    return make_cache_key(doc_hash, num_questions, additional_note, compression_ratio)
+
+
+class BatchWriter:
+    """Appends each finished document to the JSONL output, then records it in a progress file.
+
+    Every progress entry stores the output size right after that document was flushed. On resume the
+    output is truncated back to the last recorded size, dropping a document that was cut off mid-write.
+    An existing output without a progress file is never touched.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.progress_path = f"{output_path}.progress"
+        self.completed = set()
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.progress_path):
+            if os.path.exists(self.output_path) and os.path.getsize(self.output_path) > 0:
+                raise FileExistsError(f"{self.output_path} already exists and has no progress file to resume from; remove it or choose another output")
+            return
+
+        output_size = 0
+        with open(self.progress_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # A progress line cut off by the interruption
+                if "completion_key" in entry:
+                    self.completed.add(entry["completion_key"])
+                output_size = entry["output_size"]
+        with open(self.output_path, "ab") as f:
+            f.truncate(output_size)
+
+    def write_document(self, source, doc_hash, key, questions):
+        lines = "".join(json.dumps({"source": source, "document_hash": doc_hash, **question}, ensure_ascii=False) + "\n" for question in questions)
+        with self._lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                output_size = f.tell()
+            with open(self.progress_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"source": source, "document_hash": doc_hash, "completion_key": key, "questions": len(questions), "output_size": output_size}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.completed.add(key)
+
+
+def generate_document_questions(path, file_type, num_questions, additional_note, max_concurrent_requests, fresh, api_key, compression_ratio=1.0, completed=()):
+    # Reads the document once; returns None when it was already generated with these settings
+    with open(path, "rb") as f:
+        data = f.read()
+    doc_hash = document_hash(data, file_type)
+    key = completion_key(doc_hash, num_questions, additional_note, compression_ratio)
+    if key in completed:
+        return None
+    with metrics.span("extract", files=1) as extract_span:
+        content = "".join(strip_page_furniture(iter_document_pages(data, file_type)))
+        extract_span["chars"] = len(content)
+    # Each document takes its turn with the shared scheduler like a separate app session would
+    questions = generate_questions(content, num_questions, additional_note, max_concurrent_requests=max_concurrent_requests, fresh=fresh, stream=False, api_key=api_key, session_id=path,
+                                   compression_ratio=compression_ratio)
+    return doc_hash, key, questions
+
+
+def run_batch(input_dir, output_path, num_questions, additional_note="", workers=2, max_concurrent_requests=MAX_CONCURRENT_REQUESTS, fresh=False, api_key=None,
+              compression_ratio=1.0):
+    if api_key is None:
+        api_key = get_api_key()
+    writer = BatchWriter(output_path)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, generate_document_questions, path, file_type, num_questions, additional_note, max_concurrent_requests, fresh, api_key,
+                            compression_ratio, writer.completed): path
+            for path, file_type in find_documents(input_dir)
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            source = os.path.relpath(path, input_dir)
+            try:
+                result = future.result()
+            except Exception as e:
+                # Left out of the progress file, so the next run retries it
+                print(f"Failed to generate questions for {path}: {e}", file=sys.stderr)
+                failed.append(path)
+                continue
+            if result is None:
+                print(f"Skipping {path}, already generated")
+                continue
+            doc_hash, key, questions = result
+            writer.write_document(source, doc_hash, key, questions)
+            print(f"Wrote {len(questions)} questions for {source}")
+
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate question banks for every PDF/DOC/DOCX under a directory.")
+    parser.add_argument("input_dir", help="Directory to search for study documents")
+    parser.add_argument("output", help="JSONL file questions are appended to")
+    parser.add_argument("--multiple-choice", type=int, default=5)
+    parser.add_argument("--identification", type=int, default=5)
+    parser.add_argument("--true-false", type=int, default=5)
+    parser.add_argument("--note", default="", help="Additional notes passed to the model")
+    parser.add_argument("--workers", type=int, default=2, help="Documents generated at the same time")
+    parser.add_argument("--concurrent-requests", type=int, default=MAX_CONCURRENT_REQUESTS, help="Model requests in flight per document")
+    parser.add_argument("--fresh", action="store_true", help="Ignore cached responses")
+    parser.add_argument("--compress", type=float, default=1.0, help="Share of each chunk's tokens sent to the model (0-1], keeping its most informative sentences")
+    parser.add_argument("--metrics", help="Write per-stage timings to this file, as Prometheus text if it ends in .prom, otherwise JSON lines")
+    args = parser.parse_args(argv)
+
+    num_questions = {
+        "multiple_choice": args.multiple_choice,
+        "identification": args.identification,
+        "true_false": args.true_false
+    }
+    instrumentation = Instrumentation() if args.metrics else None
+    with recording(instrumentation):
+        try:
+            failed = run_batch(args.input_dir, args.output, num_questions, args.note, args.workers, args.concurrent_requests, args.fresh,
+                               compression_ratio=args.compress)
+        except FileExistsError as e:
+            print(e, file=sys.stderr)
+            return 2
+    if instrumentation is not None:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(instrumentation.to_prometheus() if args.metrics.endswith(".prom") else instrumentation.to_json_lines())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
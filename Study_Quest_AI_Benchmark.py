@@ -0,0 +1,425 @@
+"""Offline benchmarks for the question generation pipeline.
+
+Runs extraction, splitting, parsing and end-to-end generation over synthetic documents against a local
+stand-in for genai.GenerativeModel, and reports throughput and p50/p95/p99 latency for every stage:
+
+    python Study_Quest_AI_Benchmark.py --pages 10 100 500 --latency 0.2 --malformed-rate 0.1 --concurrency 4
+
+--imports instead times cold starts: importing each entry module, and the app's first page render, in fresh interpreters.
+"""
+from Study_Quest_AI_Extraction import PDF_MIME_TYPE, WORD_MIME_TYPES
+from Study_Quest_AI_Scheduler import RequestScheduler, set_scheduler
+from Study_Quest_AI_Backends import OllamaBackend
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Study_Quest_AI_Cache import DiskCache
+import Study_Quest_AI_Extraction
+import Study_Quest_AI_Functions
+import subprocess
+import threading
+import tempfile
+import argparse
+import hashlib
+import random
+import time
+import json
+import math
+import sys
+import re
+import os
+
+
+FAKE_WORDS = """
+    cell membrane protein enzyme energy glucose respiration photosynthesis chlorophyll nucleus mitosis meiosis
+    chromosome gene allele mutation evolution selection species ecosystem population community habitat niche
+    carbon nitrogen oxygen water cycle climate atmosphere pressure temperature velocity force mass momentum
+""".split()
+# Matches both the mixed group prompt and the single-type prompt of generate_typed_questions
+QUESTION_COUNT_PATTERNS = {
+    "identification": re.compile(r"Identification: (\d+) questions|Generate me (\d+) identification questions"),
+    "multiple_choice": re.compile(r"Multiple Choice: (\d+) questions|Generate me (\d+) multiple choice questions"),
+    "true_false": re.compile(r"True or False: (\d+) questions|Generate me (\d+) true or false questions")
+}
+
+
+class FakeServiceUnavailable(Exception):
+    """Raised by FakeGenerativeModel to simulate a transient 503 from the API."""
+    code = 503
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Deterministic local stand-in for genai.GenerativeModel.
+
+    Answers the group prompt with the requested number of questions per type after a configurable delay,
+    and can be told to fail outright or return malformed JSON for a share of its calls.
+    """
+
+    def __init__(self, latency=0.2, latency_jitter=0.05, failure_rate=0.0, malformed_rate=0.0, stream_pieces=8, seed=0, context_tokens=1048576):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.stream_pieces = stream_pieces
+        self.seed = seed
+        self.context_tokens = context_tokens
+        self.request_latencies = []
+        self._calls_per_prompt = {}
+        self._lock = threading.Lock()
+
+    def _random_for(self, prompt):
+        # Seeded by prompt and by how often that prompt was seen, so results do not depend on thread scheduling
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            call_number = self._calls_per_prompt.get(prompt_hash, 0)
+            self._calls_per_prompt[prompt_hash] = call_number + 1
+        return random.Random(f"{self.seed}:{prompt_hash}:{call_number}")
+
+    def _build_response(self, prompt, generator):
+        questions = []
+        for type_of_test, pattern in QUESTION_COUNT_PATTERNS.items():
+            match = pattern.search(prompt)
+            for _ in range(int(match.group(1) or match.group(2)) if match else 0):
+                question_text = " ".join(generator.choice(FAKE_WORDS) for _ in range(12))
+                question = {"type_of_test": type_of_test, "question": f"What about {question_text}?"}
+                if type_of_test == "multiple_choice":
+                    question["choices"] = {letter: generator.choice(FAKE_WORDS) for letter in "abcd"}
+                    question["answer"] = generator.choice("abcd")
+                elif type_of_test == "true_false":
+                    question["answer"] = generator.random() < 0.5
+                else:
+                    question["answer"] = generator.choice(FAKE_WORDS)
+                questions.append(question)
+
+        text = json.dumps(questions, indent=2)
+        if questions and generator.random() < self.malformed_rate:
+            text = text[:generator.randint(1, len(text) - 1)]  # Cut off mid-array like a truncated completion
+        return text
+
+    def generate_content(self, prompt, stream=False):
+        start = time.perf_counter()
+        generator = self._random_for(prompt)
+        delay = max(0.0, generator.gauss(self.latency, self.latency_jitter))
+        if generator.random() < self.failure_rate:
+            time.sleep(delay)
+            raise FakeServiceUnavailable("503 The service is currently unavailable")
+        text = self._build_response(prompt, generator)
+        if not stream:
+            time.sleep(delay)
+            self.request_latencies.append(time.perf_counter() - start)
+            return FakeResponse(text)
+        return self._stream(text, delay, start)
+
+    def _stream(self, text, delay, start):
+        piece_size = max(1, math.ceil(len(text) / self.stream_pieces))
+        for i in range(0, len(text), piece_size):
+            time.sleep(delay / self.stream_pieces)
+            yield FakeResponse(text[i:i + piece_size])
+        self.request_latencies.append(time.perf_counter() - start)
+
+
+class FakeOllamaServer:
+    """Local stand-in for an Ollama server: /api/chat answered by a FakeGenerativeModel over real HTTP."""
+
+    def __init__(self, fake_model, host="127.0.0.1", port=0):
+        self.fake_model = fake_model
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                prompt = body["messages"][-1]["content"]
+                try:
+                    response = server.fake_model.generate_content(prompt, stream=body.get("stream", False))
+                except FakeServiceUnavailable:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                prompt_tokens = len(prompt) // 4
+                if not body.get("stream", False):
+                    payload = json.dumps({"message": {"role": "assistant", "content": response.text}, "done": True,
+                                          "prompt_eval_count": prompt_tokens, "eval_count": len(response.text) // 4}).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for piece in response:
+                    self._write_chunk(json.dumps({"message": {"role": "assistant", "content": piece.text}, "done": False}) + "\n")
+                self._write_chunk(json.dumps({"message": {"role": "assistant", "content": ""}, "done": True, "prompt_eval_count": prompt_tokens}) + "\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
+
+
+def _escape_pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_synthetic_pdf(num_pages, words_per_page=400, seed=0):
+    # Hand-written PDF 1.4 with one Helvetica text stream per page, readable by PdfReader
+    generator = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    page_ids = []
+    for page in range(num_pages):
+        words = [generator.choice(FAKE_WORDS) for _ in range(words_per_page)]
+        lines = [" ".join(words[i:i + 12]) + "." for i in range(0, len(words), 12)]
+        lines.append(f"Page {page + 1}")
+        content = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({_escape_pdf_text(line)}) Tj T*" for line in lines) + " ET"
+        content = content.encode("latin-1")
+        page_ids.append(len(objects) + 1)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{page_id} 0 R' for page_id in page_ids)}] /Count {num_pages} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+
+def make_synthetic_word_document(num_pages, words_per_page=400, seed=0):
+    # read_uploaded_files decodes Word uploads as UTF-8 text, so the payload mirrors that
+    generator = random.Random(seed)
+    paragraphs = []
+    for _ in range(num_pages):
+        words = [generator.choice(FAKE_WORDS) for _ in range(words_per_page)]
+        paragraphs.append(" ".join(words) + ".")
+    return "\n\n".join(paragraphs).encode("utf-8")
+
+
+class SyntheticUpload:
+    """Mimics the name/type/getvalue() surface of a Streamlit UploadedFile."""
+
+    def __init__(self, name, file_type, data):
+        self.name = name
+        self.type = file_type
+        self.size = len(data)
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+        self.units = {}
+
+    def record(self, stage, seconds, units=1, unit_name="items"):
+        self.samples.setdefault(stage, []).append(seconds)
+        total_units, _ = self.units.get(stage, (0, unit_name))
+        self.units[stage] = (total_units + units, unit_name)
+
+    def time(self, stage, function, *args, units=1, unit_name="items", **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.record(stage, time.perf_counter() - start, units, unit_name)
+        return result
+
+    def report(self):
+        rows = []
+        for stage, samples in self.samples.items():
+            total_units, unit_name = self.units[stage]
+            total_seconds = sum(samples)
+            rows.append({
+                "stage": stage,
+                "runs": len(samples),
+                "throughput": total_units / total_seconds if total_seconds else 0.0,
+                "unit": f"{unit_name}/s",
+                "p50_ms": percentile(samples, 0.50) * 1000,
+                "p95_ms": percentile(samples, 0.95) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000
+            })
+        return rows
+
+
+def format_report(rows):
+    lines = [f"{'stage':<36}{'runs':>6}{'throughput':>16}  {'unit':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for row in rows:
+        lines.append(f"{row['stage']:<36}{row['runs']:>6}{row['throughput']:>16.2f}  {row['unit']:<14}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    return "\n".join(lines)
+
+
+def run_benchmark(page_counts=(10, 100), num_questions=None, latency=0.2, failure_rate=0.0, malformed_rate=0.0, concurrency=Study_Quest_AI_Functions.MAX_CONCURRENT_REQUESTS, repeats=3, stream=False, seed=0, requests_per_minute=60000, backend="gemini", context_tokens=1048576):
+    if num_questions is None:
+        num_questions = {"multiple_choice": 10, "identification": 5, "true_false": 5}
+    timer = StageTimer()
+    fake_model = FakeGenerativeModel(latency=latency, failure_rate=failure_rate, malformed_rate=malformed_rate, seed=seed, context_tokens=context_tokens)
+    failed_generations = 0
+
+    # Point both on-disk caches at a throwaway directory so runs start cold and leave nothing behind
+    original_response_cache = Study_Quest_AI_Functions.response_cache
+    original_text_cache = Study_Quest_AI_Extraction.text_cache
+    # The "ollama" backend goes through OllamaBackend and real HTTP to a local stand-in server
+    fake_server = FakeOllamaServer(fake_model) if backend == "ollama" else None
+    if fake_server is not None:
+        fake_server.__enter__()
+        ollama_backend = OllamaBackend(base_url=fake_server.url, pool_size=concurrency, context_tokens=context_tokens)
+        original_model_factory = Study_Quest_AI_Functions.set_model_factory(lambda model_name, generation_config, api_key: ollama_backend)
+    else:
+        original_model_factory = Study_Quest_AI_Functions.set_model_factory(lambda model_name, generation_config, api_key: fake_model)
+    # Fake failures are retried like real 503s, on a backoff scaled to the fake latency
+    original_scheduler = set_scheduler(RequestScheduler(requests_per_minute=requests_per_minute, base_delay=max(latency, 0.01), max_delay=max(latency, 0.01) * 8))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        Study_Quest_AI_Functions.response_cache = DiskCache(os.path.join(cache_dir, "responses"), original_response_cache.max_bytes)
+        Study_Quest_AI_Extraction.text_cache = DiskCache(os.path.join(cache_dir, "extracted_text"), original_text_cache.max_bytes)
+        try:
+            for num_pages in page_counts:
+                documents = [
+                    SyntheticUpload(f"synthetic_{num_pages}.pdf", PDF_MIME_TYPE, make_synthetic_pdf(num_pages, seed=seed)),
+                    SyntheticUpload(f"synthetic_{num_pages}.docx", WORD_MIME_TYPES[1], make_synthetic_word_document(num_pages, seed=seed))
+                ]
+                for document in documents:
+                    megabytes = document.size / (1024 * 1024)
+                    kind = "pdf" if document.type == PDF_MIME_TYPE else "docx"
+                    for repeat in range(repeats):
+                        content = timer.time(f"extract_{kind}", lambda: "".join(Study_Quest_AI_Extraction.iter_uploaded_files_pages([document], use_cache=False)), units=megabytes, unit_name="MB")
+                    Study_Quest_AI_Functions.read_uploaded_files([document])  # Populates the extracted text cache
+                    for repeat in range(repeats):
+                        timer.time(f"extract_{kind}_cached", Study_Quest_AI_Functions.read_uploaded_files, [document], units=megabytes, unit_name="MB")
+                    texts = timer.time("split_text", Study_Quest_AI_Functions.split_text, content, units=len(content) / (1024 * 1024), unit_name="MB")
+                    print(f"{document.name}: {document.size} bytes, {len(texts)} chunks")
+
+                    for cache_state, fresh in (("cold", True), ("warm", False)):
+                        start = time.perf_counter()
+                        try:
+                            questions = Study_Quest_AI_Functions.generate_questions(content, num_questions, "", max_concurrent_requests=concurrency, fresh=fresh, stream=stream, api_key="benchmark")
+                        except Exception as e:
+                            failed_generations += 1
+                            print(f"Generation failed for {document.name} ({cache_state} cache): {e}")
+                            continue
+                        timer.record(f"generate_{cache_state}_cache", time.perf_counter() - start, len(questions), "questions")
+        finally:
+            Study_Quest_AI_Functions.set_model_factory(original_model_factory)
+            set_scheduler(original_scheduler)
+            if fake_server is not None:
+                ollama_backend.close()
+                fake_server.__exit__(None, None, None)
+            Study_Quest_AI_Functions.response_cache = original_response_cache
+            Study_Quest_AI_Extraction.text_cache = original_text_cache
+
+    for request_latency in fake_model.request_latencies:
+        timer.record("chunk_request", request_latency)
+
+    response_generator = FakeGenerativeModel(latency=0.0, seed=seed)
+    sample_prompt = Study_Quest_AI_Functions.build_group_prompt("", num_questions, "")
+    sample_responses = [response_generator._build_response(sample_prompt, random.Random(i)) for i in range(200)]
+    for response in sample_responses:
+        timer.time("extract_and_parse_json", Study_Quest_AI_Functions.extract_and_parse_json, response, units=len(response) / (1024 * 1024), unit_name="MB")
+
+    return timer.report(), failed_generations
+
+
+# Modules a worker, CLI run or app session starts by importing
+COLD_START_MODULES = ["Study_Quest_AI_Functions", "Study_Quest_AI_Jobs", "Study_Quest_AI_Batch", "Study_Quest_AI_Export", "Study_Quest_AI_Store"]
+FIRST_RENDER_SCRIPT = """
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("Study_Quest_AI.py", default_timeout=60)
+app.secrets["GOOGLE_GEN_AI_API_KEY"] = "benchmark"
+app.run()
+assert not app.exception, app.exception
+"""
+
+
+def run_import_benchmark(modules=COLD_START_MODULES, repeats=5, render=True):
+    # Every sample is a fresh interpreter, so nothing is already in sys.modules; "interpreter" is the floor all of them pay
+    timer = StageTimer()
+    root = os.path.dirname(os.path.abspath(__file__))
+    stages = [("interpreter", "pass")] + [(f"import {module}", f"import {module}") for module in modules]
+    if render:
+        stages.append(("first_page_render", FIRST_RENDER_SCRIPT))
+    with tempfile.TemporaryDirectory() as store_dir:
+        env = {**os.environ, "STUDY_QUEST_STORE_PATH": os.path.join(store_dir, "question_bank.sqlite3")}
+        for stage, code in stages:
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-c", code], cwd=root, env=env, check=True, capture_output=True)
+                timer.record(stage, time.perf_counter() - start, unit_name="starts")
+    return timer.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Study Quest AI pipeline offline against a fake model.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100], help="Synthetic document sizes in pages")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean fake model latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=Study_Quest_AI_Functions.MAX_CONCURRENT_REQUESTS)
+    parser.add_argument("--repeats", type=int, default=3, help="Extraction runs per document")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming generation path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--context-tokens", type=int, default=1048576, help="Context size the fake model reports, which bounds request packing")
+    parser.add_argument("--backend", choices=["gemini", "ollama"], default="gemini", help="Call the fake model directly or through OllamaBackend and a local HTTP stand-in")
+    parser.add_argument("--requests-per-minute", type=float, default=60000, help="Request quota enforced by the scheduler")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--imports", action="store_true", help="Time module imports and the first page render in fresh interpreters instead")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        rows = run_import_benchmark(repeats=args.repeats)
+        print(json.dumps({"stages": rows}, indent=2) if args.json else format_report(rows))
+        return
+
+    rows, failed_generations = run_benchmark(args.pages, latency=args.latency, failure_rate=args.failure_rate, malformed_rate=args.malformed_rate,
+                                             concurrency=args.concurrency, repeats=args.repeats, stream=args.stream, seed=args.seed,
+                                             requests_per_minute=args.requests_per_minute, backend=args.backend,
+                                             context_tokens=args.context_tokens)
+    if args.json:
+        print(json.dumps({"stages": rows, "failed_generations": failed_generations}, indent=2))
+    else:
+        print(format_report(rows))
+        print(f"Failed generations: {failed_generations}")
+
+
+if __name__ == "__main__":
+    main()
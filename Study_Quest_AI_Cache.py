@@ -0,0 +1,110 @@
+import threading
+import hashlib
+import json
+import os
+
+
+# Root folder for everything Study Quest AI keeps on local disk between sessions
+CACHE_ROOT = os.getenv("STUDY_QUEST_CACHE_DIR", ".study_quest_cache")
+# Eviction frees space down to this share of max_bytes, so a full cache is not rescanned on every write
+EVICTION_LOW_WATER = 0.9
+
+
+def make_cache_key(*parts):
+    # Hash a canonical JSON rendering so dict ordering never changes the key
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """Content-addressed file cache bounded by total size with least-recently-used eviction.
+
+    Each entry is a file named after its key. Reads bump the file's modification time,
+    so the oldest modification time always marks the least recently used entry. Writes keep a running
+    total of the cache size; the directory is only scanned once that total goes over max_bytes, which
+    also resynchronises it with entries other processes wrote or removed.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Unknown until the first scan
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}{suffix}")
+
+    def get_path(self, key, suffix=".json"):
+        path = self._path(key, suffix)
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get(self, key, suffix=".json"):
+        path = self.get_path(key, suffix)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None  # Evicted by another thread between the touch and the read
+
+    def put(self, key, data, suffix=".json"):
+        path = self._path(key, suffix)
+        try:
+            replaced_bytes = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced_bytes = 0
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)  # Readers never observe a half-written entry
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data) - replaced_bytes
+            over_limit = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+        return path
+
+    def get_json(self, key):
+        data = self.get(key, ".json")
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return None
+
+    def put_json(self, key, value):
+        return self.put(key, json.dumps(value, ensure_ascii=False).encode("utf-8"), ".json")
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            total_bytes = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+            if total_bytes > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    if total_bytes <= self.max_bytes * EVICTION_LOW_WATER:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total_bytes -= size
+            self._total_bytes = total_bytes
@@ -0,0 +1,102 @@
+import threading
+import hashlib
+import re
+
+
+# MinHash is computed modulo a Mersenne prime below 2**32 so a * hash + b never overflows uint64
+MERSENNE_PRIME = (1 << 31) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def question_shingles(question, shingle_size=3):
+    # Word n-grams over the normalised question and answer text
+    answer = question.get("answer", "")
+    text = f"{question.get('question', '')} {answer}".lower()
+    words = WORD_PATTERN.findall(text)
+    if len(words) <= shingle_size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+
+class NearDuplicateIndex:
+    """MinHash signatures bucketed by LSH bands, so a lookup only compares against likely matches.
+
+    With the defaults (16 bands of 4 rows) a pair at 0.8 Jaccard similarity becomes a candidate
+    with probability above 0.999, while unrelated questions almost never share a bucket.
+    """
+
+    def __init__(self, threshold=0.8, num_permutations=64, bands=16, shingle_size=3, seed=1):
+        if num_permutations % bands != 0:
+            raise ValueError("num_permutations must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_permutations // bands
+        self.shingle_size = shingle_size
+        import numpy as np  # Deferred to the first index, so importing the pipeline does not load numpy
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, MERSENNE_PRIME, size=(num_permutations, 1), dtype=np.uint64)
+        self._b = generator.integers(0, MERSENNE_PRIME, size=(num_permutations, 1), dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, question):
+        import numpy as np
+        shingle_hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little") for shingle in question_shingles(question, self.shingle_size)),
+            dtype=np.uint64
+        )
+        return ((self._a * shingle_hashes + self._b) % MERSENNE_PRIME).min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _find(self, signature, band_keys):
+        candidates = set()
+        for band, key in enumerate(band_keys):
+            candidates.update(self._buckets[band].get(key, ()))
+        for candidate in candidates:
+            if (self._signatures[candidate] == signature).mean() >= self.threshold:
+                return candidate
+        return None
+
+    def find_duplicate(self, question):
+        signature = self.signature(question)
+        with self._lock:
+            return self._find(signature, self._band_keys(signature))
+
+    def add(self, question, question_id=None):
+        # Adds the question and returns the id of an earlier near-duplicate, or None if it is new
+        signature = self.signature(question)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            duplicate_id = self._find(signature, band_keys)
+            if duplicate_id is not None:
+                return duplicate_id
+            if question_id is None:
+                question_id = len(self._signatures)
+            self._signatures[question_id] = signature
+            for band, key in enumerate(band_keys):
+                self._buckets[band].setdefault(key, []).append(question_id)
+            return None
+
+
+def build_dedup_index(questions, **index_options):
+    index = NearDuplicateIndex(**index_options)
+    for question_id, question in enumerate(questions):
+        index.add(question, question_id)
+    return index
+
+
+def find_near_duplicates(questions, **index_options):
+    # Returns [(index of duplicate, index of the earlier question it repeats)]
+    index = NearDuplicateIndex(**index_options)
+    duplicates = []
+    for question_id, question in enumerate(questions):
+        duplicate_id = index.add(question, question_id)
+        if duplicate_id is not None:
+            duplicates.append((question_id, duplicate_id))
+    return duplicates
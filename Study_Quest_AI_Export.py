@@ -0,0 +1,158 @@
+"""Streaming export and import of question banks.
+
+The export is JSON lines, gzip-compressed by default: a header line, then one question per line with
+its scoring history under "history". Files are read line by line, every question is validated with
+validate_and_convert_json, and valid ones are merged into the open bank in batches, so importing a
+large bank never holds the parsed file in memory. Imports also accept the batch CLI's JSONL output
+and the older single-object JSON export.
+"""
+from Study_Quest_AI_Functions import QUESTION_TYPES, validate_and_convert_json
+from Study_Quest_AI_Bank import Question
+import gzip
+import json
+import io
+
+
+EXPORT_FORMAT = "study_quest_bank"
+EXPORT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+IMPORT_BATCH_SIZE = 1000
+
+# Scoring-history fields carried in an export; the question itself is the rest of the record
+HISTORY_FIELDS = ["times_wrong", "ease", "interval", "repetitions", "due", "times_reviewed"]
+
+
+def iter_export_lines(questions, scoring_history):
+    # questions is a sequence of question dicts, or an iterable of (position, question, history entry) like QuestionStore.iter_bank
+    yield json.dumps({"format": EXPORT_FORMAT, "version": EXPORT_VERSION}) + "\n"
+    for position, item in enumerate(questions):
+        if isinstance(item, tuple):
+            position, question, history_entry = item
+        else:
+            question = item
+            history_entry = scoring_history.get(position) or scoring_history.get(str(position)) or {}
+        history = {field: history_entry[field] for field in HISTORY_FIELDS if history_entry.get(field) is not None}
+        yield json.dumps({**question, "history": history}, ensure_ascii=False) + "\n"
+
+
+def write_bank_export(lines, fileobj, compress=True):
+    # Writes to a binary file object one line at a time
+    if compress:
+        with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed:
+            for line in lines:
+                compressed.write(line.encode("utf-8"))
+    else:
+        for line in lines:
+            fileobj.write(line.encode("utf-8"))
+
+
+def open_bank_file(fileobj):
+    # Text stream over an uploaded export, decompressing when it starts with the gzip magic bytes
+    head = fileobj.read(2)
+    fileobj.seek(0)
+    if head == GZIP_MAGIC:
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    return io.TextIOWrapper(fileobj, encoding="utf-8")
+
+
+def iter_legacy_records(data):
+    # The original {"questions": [...], "scoring_history": {"0": {...}}} export, whose history keys came back as strings
+    scoring_history = {int(key): entry for key, entry in data.get("scoring_history", {}).items()}
+    for position, question in enumerate(data.get("questions", [])):
+        history_entry = scoring_history.get(position, {})
+        yield {**question, "history": {field: history_entry[field] for field in HISTORY_FIELDS if field in history_entry}}
+
+
+def iter_bank_records(fileobj):
+    lines = open_bank_file(fileobj)
+    first_line = lines.readline()
+    try:
+        first_record = json.loads(first_line)
+    except json.JSONDecodeError:
+        if first_line.lstrip().startswith("{"):
+            # An indented legacy export spans many lines and has to be parsed whole
+            yield from iter_legacy_records(json.loads(first_line + lines.read()))
+            return
+        raise ValueError("Not a question bank export")
+    if isinstance(first_record, dict) and "questions" in first_record:
+        yield from iter_legacy_records(first_record)
+        return
+    if not (isinstance(first_record, dict) and first_record.get("format") == EXPORT_FORMAT):
+        yield first_record  # Batch output has no header line
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+
+def question_identity(question):
+    return question.get("type_of_test"), " ".join(str(question.get("question", "")).lower().split())
+
+
+def validate_record(record):
+    # (question, history entry) for a valid record, otherwise None
+    if not isinstance(record, dict) or record.get("type_of_test") not in QUESTION_TYPES:
+        return None
+    history = record.get("history") or {}
+    question = {key: value for key, value in record.items() if key not in ("history", "document_hash")}
+    question, valid = validate_and_convert_json(question, question["type_of_test"])
+    if not valid:
+        return None
+    return question, {field: history[field] for field in HISTORY_FIELDS if field in history}
+
+
+def import_bank(fileobj, questions, scoring_history, store=None, bank_id=None, batch_size=IMPORT_BATCH_SIZE):
+    # Appends the file's valid, not yet present questions to questions/scoring_history (and the store's bank,
+    # one batch at a time). Returns counts of imported, duplicate and invalid records.
+    # A file that fails part-way (e.g. a truncated download) leaves nothing behind, so the same upload can be retried
+    start_position = len(questions)
+    try:
+        return _import_records(fileobj, questions, scoring_history, store, bank_id, batch_size)
+    except Exception:
+        del questions[start_position:]
+        for position in [position for position in scoring_history if position >= start_position]:
+            del scoring_history[position]
+        if store is not None and bank_id is not None:
+            store.truncate_bank(bank_id, start_position)
+        raise
+
+
+def _import_records(fileobj, questions, scoring_history, store, bank_id, batch_size):
+    known_questions = {question_identity(question) for question in questions}
+    report = {"imported": 0, "duplicates": 0, "invalid": 0}
+    batch = []
+    batch_history = {}
+
+    def flush():
+        if store is not None and bank_id is not None and batch:
+            store.add_questions(bank_id, batch, scoring_history=batch_history, start_position=len(questions) - len(batch))
+        batch.clear()
+        batch_history.clear()
+
+    for record in iter_bank_records(fileobj):
+        validated = validate_record(record)
+        if validated is None:
+            report["invalid"] += 1
+            continue
+        question, history_entry = validated
+        identity = question_identity(question)
+        if identity in known_questions:
+            report["duplicates"] += 1
+            continue
+        known_questions.add(identity)
+
+        position = len(questions)
+        question["question_number"] = f"{position + 1}"
+        question = Question.from_dict(question)
+        questions.append(question)
+        if history_entry:
+            scoring_history[position] = {"times_wrong": 0, **history_entry}
+        batch_history[len(batch)] = history_entry
+        batch.append(question)
+        report["imported"] += 1
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return report
@@ -0,0 +1,120 @@
+from Study_Quest_AI_Cache import CACHE_ROOT, DiskCache
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import array
+import mmap
+import io
+import os
+
+
+PDF_MIME_TYPE = "application/pdf"
+WORD_MIME_TYPES = ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]
+
+# PDFs shorter than this are parsed in-process, the pool start-up cost outweighs the gain
+PARALLEL_EXTRACTION_MIN_PAGES = 32
+# Pages handed to a worker per task, large enough to amortise the inter-process round-trip
+EXTRACTION_PAGES_PER_TASK = 8
+MAX_EXTRACTION_WORKERS = os.cpu_count() or 1
+
+# Bump whenever extraction output changes so stale cached text is never served
+EXTRACTOR_VERSION = 1
+# Extracted text is stored as raw UTF-8 (<hash>.txt) next to an int64 array of page byte offsets (<hash>.pages),
+# so both can be memory-mapped and sliced per page without parsing anything
+TEXT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+text_cache = DiskCache(os.path.join(CACHE_ROOT, "extracted_text"), TEXT_CACHE_MAX_BYTES)
+
+# Each worker process parses the PDF once and keeps the reader for every page range it is handed
+_worker_reader = None
+
+
+def _init_extraction_worker(data):
+    global _worker_reader
+    from PyPDF2 import PdfReader
+    _worker_reader = PdfReader(io.BytesIO(data))
+
+
+def _extract_page_range(page_range):
+    start, stop = page_range
+    return [_worker_reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def iter_pdf_pages(data, max_workers=MAX_EXTRACTION_WORKERS):
+    from PyPDF2 import PdfReader  # Deferred so text-only and cached runs never load the PDF parser
+    reader = PdfReader(io.BytesIO(data))
+    num_pages = len(reader.pages)
+
+    if max_workers <= 1 or num_pages < PARALLEL_EXTRACTION_MIN_PAGES:
+        for page in reader.pages:
+            yield page.extract_text() or ""
+        return
+
+    page_ranges = [(start, min(start + EXTRACTION_PAGES_PER_TASK, num_pages)) for start in range(0, num_pages, EXTRACTION_PAGES_PER_TASK)]
+    workers = min(max_workers, len(page_ranges))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_extraction_worker, initargs=(data,)) as executor:
+        # map() hands results back in page order as soon as each range is done, so callers can start early
+        for page_texts in executor.map(_extract_page_range, page_ranges):
+            yield from page_texts
+
+
+def document_hash(data, file_type):
+    digest = hashlib.sha256(data)
+    digest.update(f"\0{file_type}\0{EXTRACTOR_VERSION}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_cached_pages(key):
+    text_path = text_cache.get_path(key, ".txt")
+    offsets_path = text_cache.get_path(key, ".pages")
+    if text_path is None or offsets_path is None:
+        return None
+
+    try:
+        with open(offsets_path, "rb") as f:
+            offsets = array.array("q")
+            offsets.frombytes(f.read())
+        with open(text_path, "rb") as f:
+            if offsets[-1] == 0:
+                return ["" for _ in range(len(offsets) - 1)]
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as text_map:
+                return [text_map[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+    except (FileNotFoundError, IndexError, ValueError, UnicodeDecodeError):
+        return None  # Half-evicted or corrupt entry, extract again
+
+
+def store_cached_pages(key, pages):
+    encoded_pages = [page.encode("utf-8") for page in pages]
+    offsets = array.array("q", [0])
+    for encoded_page in encoded_pages:
+        offsets.append(offsets[-1] + len(encoded_page))
+    text_cache.put(key, b"".join(encoded_pages), ".txt")
+    text_cache.put(key, offsets.tobytes(), ".pages")
+
+
+def extract_document_pages(data, file_type, max_workers=MAX_EXTRACTION_WORKERS):
+    if file_type == PDF_MIME_TYPE:
+        yield from iter_pdf_pages(data, max_workers=max_workers)
+    elif file_type in WORD_MIME_TYPES:
+        yield data.decode("utf-8")
+
+
+def iter_document_pages(data, file_type, max_workers=MAX_EXTRACTION_WORKERS, use_cache=True):
+    if not use_cache:
+        yield from extract_document_pages(data, file_type, max_workers=max_workers)
+        return
+
+    key = document_hash(data, file_type)
+    cached_pages = load_cached_pages(key)
+    if cached_pages is not None:
+        yield from cached_pages
+        return
+
+    pages = []
+    for page in extract_document_pages(data, file_type, max_workers=max_workers):
+        pages.append(page)
+        yield page
+    store_cached_pages(key, pages)
+
+
+def iter_uploaded_files_pages(files, max_workers=MAX_EXTRACTION_WORKERS, use_cache=True):
+    for file in files:
+        yield from iter_document_pages(file.getvalue(), file.type, max_workers=max_workers, use_cache=use_cache)
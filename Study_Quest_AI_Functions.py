@@ -1,455 +1,1001 @@
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import google.generativeai as genai
-from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-import streamlit as st
-import requests
-import random
-import json
-import re
-import os
-
-
-#Configure this one to True if deployed on streamlit community cloud or on local machine
-#This helps change the json file and api key loading
-is_streamlit_deployed = False
-
-if "api_keys" not in st.session_state:
-    st.session_state["api_keys"] = {}
-
-if is_streamlit_deployed:
-    st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"] = st.secrets["GOOGLE_GEN_AI_API_KEY"]
-else:
-    load_dotenv(dotenv_path='cred.env')  # This method will read key-value pairs from a .env file and add them to environment variable.
-    st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"] = os.getenv('GOOGLE_GEN_AI_API_KEY')
-
-def extract_and_parse_json(text):
-    # Find the first opening and the last closing curly brackets
-    start_index = text.find('[')
-    end_index = text.rfind(']')
-    
-    if start_index == -1 or end_index == -1 or end_index < start_index:
-        return None, False  # Proper JSON structure not found
-
-    # Extract the substring that contains the JSON
-    json_str = text[start_index:end_index + 1]
-
-    try:
-        # Attempt to parse the JSON
-        parsed_json = json.loads(json_str)
-        return parsed_json, True
-    except json.JSONDecodeError:
-        return None, False  # JSON parsing failed
-    
-def validate_and_convert_json(json_input, type_of_question):
-
-    def is_valid_question(data):
-        if type_of_question == "multiple_choice":
-            return is_valid_multiple_choice_question(data)
-        elif type_of_question == "identification":
-            return is_valid_identification_question(data)
-        elif type_of_question == "true_false":
-            return is_valid_true_false_question(data)
-        else:
-            raise ValueError("type of question doesn't yet exist")  
-        return False
-
-    def is_valid_multiple_choice_question(data):
-        # Check for the presence of all required keys
-        return (
-            "question" in data and
-            "choices" in data and
-            "answer" in data and
-            "a" in data["choices"] and
-            "b" in data["choices"] and
-            "c" in data["choices"] and
-            "d" in data["choices"] and
-            isinstance(data["answer"], str) and
-            data["answer"] in ['a', 'b', 'c', 'd']
-        )
-    
-    def is_valid_identification_question(data):
-        return(
-            "question" in data and
-            "answer" in data
-        )
-    
-    def is_valid_true_false_question(data):
-        return (
-            "question" in data and
-            "answer" in data and 
-            isinstance(data["answer"], bool)  # Checks if the type of data["answer"] is boolean
-        )
-
-    # If the input is already a dictionary, validate it directly
-    if isinstance(json_input, dict):
-        valid = is_valid_question(json_input)
-        return json_input, valid
-    
-    # If it's a string, attempt to parse it as JSON
-    try:
-        data = json.loads(json_input)
-        valid = is_valid_question(data)
-        return data, valid
-    except (json.JSONDecodeError, TypeError) as e:
-        return None, False  # Return None and False if parsing fails or keys are missing
-
-
-def read_uploaded_files(files):
-    content = ""
-    for file in files:
-        if file.type == "application/pdf":
-            reader = PdfReader(file)
-            for page in reader.pages:
-                content += page.extract_text()
-        elif file.type in ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
-            content += file.getvalue().decode("utf-8")
-    return content
-
-def split_text(content):
-    # Define custom separators
-    separators = ["\n\n", ". ", "\n•\n", "\n-\n", "\n", "\t"]
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=200, separators=separators)  # Expected words for an 8k context length LLaMA3:8b model local
-    texts = text_splitter.split_text(content)
-    return texts
-
-def distribute_questions(num_questions, num_groups):
-    base_questions = num_questions // num_groups
-    remainder = num_questions % num_groups
-    distribution = [base_questions] * num_groups
-    for i in range(remainder):
-        distribution[i] += 1
-    return distribution
-
-def generate_a_multiple_question(text, starting_number, type_of_test, additional_note):
-    multiple_question_json = {}
-    prompt_successful = False
-
-    prompt = f"""
-    Given the following text/content:
-    ----------------------
-    {text}
-    ----------------------
-
-    Generate me a multiple choice question in a JSON format. Please strictly follow the format below!!!:
-
-    ```json
-    {{
-        "question":<question>,
-        "choices":{{
-            "a":<choice a>,
-            "b":<choice b>,
-            "c":<choice c>,
-            "d":<choice d>
-        }}
-        "answer":<answer in small letter>
-    }}
-    ```
-
-    Additional Notes: {additional_note}
-    """
-
-    while not prompt_successful:
-        chat_log = [
-            {"role": "system", "content": "You are tasked to create questions based on a specific content/text for students that are trying to study."},
-            {"role": "user", "content": prompt}
-        ]
-        result = ollama.chat(model="llama3", messages=chat_log)
-        multiple_question_response = result["message"]["content"]  # Ensure you parse this correctly based on the actual API response
-        
-        print(f"Question Number: {starting_number}")
-        print(f"Multiple Question Response: \n\n {multiple_question_response}")
-        #Extract and check if its a valid multiple question json
-        multiple_question_json, multiple_question_parsed_successfully = extract_and_parse_json(multiple_question_response)
-        print(multiple_question_json, multiple_question_parsed_successfully)
-        
-        if multiple_question_parsed_successfully == False:
-            print(f"Error Parsing Question Number {starting_number}")
-            continue #If unsucessfull parsing was done on the salary, try again
-
-        #Assumes it passes the if condition above
-        multiple_question_json_cleaned, multiple_question_valid_json = validate_and_convert_json(multiple_question_json, type_of_test)
-        print(multiple_question_json_cleaned, multiple_question_valid_json)
-
-        if multiple_question_valid_json == False:
-            print(f"Error Parsing Question Number {starting_number}")
-            continue #If unsucessfull parsing was done on the salary, try again
-
-        #If question parsed and validated succesfully
-        multiple_question_json = multiple_question_json_cleaned
-        prompt_successful = True # Exit while loop if question processed successfully
-
-    #Populate the mulitple question json format
-    multiple_question = {
-        "question_number":f"{starting_number}",
-        "type_of_test":f"{type_of_test}",
-        "question":multiple_question_json["question"],
-        "choices":multiple_question_json["choices"],
-        "answer":multiple_question_json["answer"]
-    }
-
-    return multiple_question
-
-
-
-def generate_an_identification_question(text, starting_number, type_of_test, additional_note):
-    identifcation_question_json = {}
-    prompt_successful = False
-
-    prompt = f"""
-
-    Given the following text/content:
-    ----------------------
-    {text}
-    ----------------------
-
-    Generate me an identification question in a JSON format. Please strictly follow the format below!!!:
-
-    ```json
-    {{
-        "question":<question>,
-        "answer": <answer>
-    }}
-    ```
-
-    Additional Notes: {additional_note}
-    """
-
-    while not prompt_successful:
-        chat_log = [
-            {"role": "system", "content": "You are tasked to create questions based on a specific content/text for students that are trying to study."},
-            {"role": "user", "content": prompt}
-        ]
-        result = ollama.chat(model="llama3", messages=chat_log)
-        identifcation_question_response = result["message"]["content"]  # Ensure you parse this correctly based on the actual API response
-        
-        print(f"Question Number: {starting_number}")
-        print(f"Identification Question Response: \n\n {identifcation_question_response}")
-        #Extract and check if its a valid multiple question json
-        identifcation_question_json, identifcation_question_parsed_successfully = extract_and_parse_json(identifcation_question_response)
-        print(identifcation_question_json, identifcation_question_parsed_successfully)
-        
-        if identifcation_question_parsed_successfully == False:
-            print(f"Error Parsing Question Number {starting_number}")
-            continue #If unsucessfull parsing was done on the salary, try again
-
-        #Assumes it passes the if condition above
-        identifcation_question_json_cleaned, identifcation_question_valid_json = validate_and_convert_json(identifcation_question_json, type_of_test)
-        print(identifcation_question_json_cleaned, identifcation_question_valid_json)
-
-        if identifcation_question_valid_json == False:
-            print(f"Error Parsing Question Number {starting_number}")
-            continue #If unsucessfull parsing was done on the salary, try again
-
-        #If question parsed and validated succesfully
-        identifcation_question_json = identifcation_question_json_cleaned
-        prompt_successful = True # Exit while loop if question processed successfully
-
-    #Populate the mulitple question json format
-    identification_question = {
-        "question_number":f"{starting_number}",
-        "type_of_test":f"{type_of_test}",
-        "question":identifcation_question_json["question"],
-        "answer":identifcation_question_json["answer"]
-    }
-
-    return identification_question
-
-def generate_a_true_false_question(text, starting_number, type_of_test, additional_note):
-    true_false_question_json = {}
-    prompt_successful = False
-
-    prompt = f"""
-    Given the following text/content:
-    ----------------------
-    {text}
-    ----------------------
-
-    Generate me a true or false question in a JSON format. Please strictly follow the format below!!!:
-
-    ```json
-    {{
-        "question":<question>,
-        "answer": <boolean>
-    }}
-    ```
-
-    Additional Notes: {additional_note}
-    """
-
-    while not prompt_successful:
-        chat_log = [
-            {"role": "system", "content": "You are tasked to create questions based on a specific content/text for students that are trying to study."},
-            {"role": "user", "content": prompt}
-        ]
-        result = ollama.chat(model="llama3", messages=chat_log)
-        true_false_question_response = result["message"]["content"]  # Ensure you parse this correctly based on the actual API response
-        
-        print(f"Question Number: {starting_number}")
-        print(f"True False Response: \n\n {true_false_question_response}")
-        #Extract and check if its a valid multiple question json
-        true_false_question_json, true_false_question_parsed_successfully = extract_and_parse_json(true_false_question_response)
-        print(true_false_question_json, true_false_question_parsed_successfully)
-        
-        if true_false_question_parsed_successfully == False:
-            print(f"Error Parsing Question Number {starting_number}")
-            continue #If unsucessfull parsing was done on the salary, try again
-
-        #Assumes it passes the if condition above
-        true_false_question_json_cleaned, true_false_question_valid_json = validate_and_convert_json(true_false_question_json, type_of_test)
-        print(true_false_question_json_cleaned, true_false_question_valid_json)
-
-        if true_false_question_valid_json == False:
-            print(f"Error Parsing Question Number {starting_number}")
-            continue #If unsucessfull parsing was done on the salary, try again
-
-        #If question parsed and validated succesfully
-        true_false_question_json = true_false_question_json_cleaned
-        prompt_successful = True # Exit while loop if question processed successfully
-
-    #Populate the mulitple question json format
-    true_false_question = {
-        "question_number":f"{starting_number}",
-        "type_of_test":f"{type_of_test}",
-        "question":true_false_question_json["question"],
-        "answer":true_false_question_json["answer"]
-    }
-
-    return true_false_question
-
-def generate_questions_for_group(text, num_questions, additional_note, chunk_number):
-    questions_list = []
-
-
-    print("Generating questions...")
-
-    prompt = f"""
-    Given the following academic text below, I'd like you to generate some questions on different types of test.
-
-    Academic text:
-
-    {text}
-    --------------------------------
-    
-    I'd like you to generate these types of test of questions with the corresponding number of questions for each type of text:
-    1) Identification: {num_questions["identification"]} questions
-    2) Multiple Choice: {num_questions["multiple_choice"]} questions
-    3) True or False: {num_questions["true_false"]} questions
-
-    Note: The arrangement of the type of test should be random
-
-    Please give your output or answer using the example following json format:
-
-    ```json
-    [
-        {{
-        "type_of_test":"identification",
-        "question":<question>,
-        "answer": <answer>
-        }},
-        {{
-        "type_of_test":"true_false",
-        "question":<question>,
-        "answer": <boolean>
-        }},
-        {{
-        "type_of_test":"multiple_choice",
-        "question":<question>,
-        "choices":{{
-            "a":<choice a>,
-            "b":<choice b>,
-            "c":<choice c>,
-            "d":<choice d>
-            }}
-        "answer": <letter only in (lowercase letter)>
-        }}
-    ]
-    ```json
-
-    Notes:
-    - You can generate the type of test of the questions in no particular order as long as you generated the required number of questions per type of test.
-    - Double check the accuracy of the answers of the questions based on the academic text or content.
-    
-    Additional Notes:
-    {additional_note}
-    """
-
-    genai.configure(api_key=st.session_state["api_keys"]["GOOGLE_GEN_AI_API_KEY"])
-    # Choose a model that's appropriate for your use case.
-    model = genai.GenerativeModel('gemini-1.5-flash',
-        generation_config=genai.GenerationConfig(
-        temperature=0.8,
-        response_mime_type = "application/json"
-    ))
-
-
-    print("")
-    response_json_valid = False
-    max_attempts = 3
-    parsed_result = None
-
-    while not response_json_valid and max_attempts > 0: ## Wait till the response json is valid
-        response = model.generate_content(prompt).text
-        parsed_result, response_json_valid = extract_and_parse_json(response)
-        if response_json_valid == False:
-            print(f"Failed to validate and parse json for chunk text group {chunk_number}... Trying again...")
-            max_attempts = max_attempts - 1 
-
-        print(f"Parsed Results for chunk text group {chunk_number}: {parsed_result}")
-        
-    
-    return parsed_result
-
-def generate_questions(content, num_questions, additional_note):
-    texts = split_text(content)
-    num_groups = len(texts)
-
-    distributed_questions = {
-        "multiple_choice": distribute_questions(num_questions['multiple_choice'], num_groups),
-        "identification": distribute_questions(num_questions['identification'], num_groups),
-        "true_false": distribute_questions(num_questions['true_false'], num_groups)
-    }
-
-    all_questions = []
-    total_questions_generated = {
-        "multiple_choice": 0,
-        "identification": 0,
-        "true_false": 0
-    }
-
-    starting_question_number = 1
-    st.session_state["starting_number"] = starting_question_number
-    for i, text in enumerate(texts):
-
-        print(f"Text group {i}:")
-        print(texts)
-        print("\n\n")
-
-        if (total_questions_generated["multiple_choice"] >= num_questions["multiple_choice"] and
-            total_questions_generated["identification"] >= num_questions["identification"] and
-            total_questions_generated["true_false"] >= num_questions["true_false"]):
-            break
-        
-        group_questions = {
-            "multiple_choice": min(distributed_questions["multiple_choice"][i], num_questions["multiple_choice"] - total_questions_generated["multiple_choice"]),
-            "identification": min(distributed_questions["identification"][i], num_questions["identification"] - total_questions_generated["identification"]),
-            "true_false": min(distributed_questions["true_false"][i], num_questions["true_false"] - total_questions_generated["true_false"])
-        }
-
-        total_questions = group_questions["multiple_choice"] + group_questions["identification"] + group_questions["true_false"]
-        print(f"Group Questions: {group_questions}")
-        print(f"Total Questions: {total_questions}")
-
-        questions = generate_questions_for_group(text, group_questions, additional_note=additional_note, chunk_number=i)
-        print(questions)
-        all_questions.extend(questions)
-        
-        
-        total_questions_generated["multiple_choice"] += group_questions["multiple_choice"]
-        total_questions_generated["identification"] += group_questions["identification"]
-        total_questions_generated["true_false"] += group_questions["true_false"]
-
-    print("Final JSON extracted \n ------------------------")
-    print(all_questions)
-    return all_questions
+
+from concurrent.futures import ThreadPoolExecutor
+from Study_Quest_AI_Extraction import iter_document_pages
+from Study_Quest_AI_Cache import CACHE_ROOT, DiskCache, make_cache_key
+from Study_Quest_AI_Dedup import build_dedup_index
+from Study_Quest_AI_Scheduler import estimate_tokens, get_scheduler
+from Study_Quest_AI_Backends import get_ollama_backend
+import Study_Quest_AI_Metrics as metrics
+from dotenv import load_dotenv
+from collections import Counter, deque
+import contextvars
+import itertools
+import threading
+import logging
+import random
+import queue
+import time
+import math
+import json
+import re
+import os
+
+
+logger = logging.getLogger(__name__)
+
+#Configure this one to True if deployed on streamlit community cloud or on local machine
+#This helps change the json file and api key loading
+is_streamlit_deployed = False
+
+if not is_streamlit_deployed:
+    load_dotenv(dotenv_path='cred.env')  # This method will read key-value pairs from a .env file and add them to environment variable.
+
+def get_api_key():
+    # Nothing here may touch st.session_state: the pipeline also runs headless from Study_Quest_AI_Batch
+    if is_streamlit_deployed:
+        import streamlit as st
+        return st.secrets["GOOGLE_GEN_AI_API_KEY"]
+    return os.getenv('GOOGLE_GEN_AI_API_KEY')
+
+# Upper bound on Gemini requests that may be in flight at once for a single generation
+MAX_CONCURRENT_REQUESTS = 4
+
+# Sentinel a worker puts on the results queue once its chunk is finished
+_GROUP_DONE = object()
+
+
+class GenerationCancelled(Exception):
+    pass
+
+# "gemini" or "ollama"; the Ollama server and model are configured in Study_Quest_AI_Backends
+MODEL_BACKEND = os.getenv("STUDY_QUEST_BACKEND", "gemini")
+MODEL_NAME = 'gemini-1.5-flash'
+GENERATION_CONFIG = {
+    "temperature": 0.8,
+    "response_mime_type": "application/json"
+}
+
+# Parsed chunk responses, reused whenever the same chunk is asked for the same questions again
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+response_cache = DiskCache(os.path.join(CACHE_ROOT, "responses"), RESPONSE_CACHE_MAX_BYTES)
+
+def extract_and_parse_json(text):
+    # Find the first opening and the last closing curly brackets
+    start_index = text.find('[')
+    end_index = text.rfind(']')
+    
+    if start_index == -1 or end_index == -1 or end_index < start_index:
+        return None, False  # Proper JSON structure not found
+
+    # Extract the substring that contains the JSON
+    json_str = text[start_index:end_index + 1]
+
+    try:
+        # Attempt to parse the JSON
+        parsed_json = json.loads(json_str)
+        return parsed_json, True
+    except json.JSONDecodeError:
+        return None, False  # JSON parsing failed
+    
+class IncrementalJSONArrayParser:
+    """Pulls complete objects out of a JSON array while the text of the array is still arriving.
+
+    Objects that fail to decode are skipped, so one broken item does not cost the rest of the array.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self._text = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    def feed(self, text):
+        if self.finished:
+            return []
+        self._text += text
+        completed = []
+        position = self._position
+        while position < len(self._text):
+            char = self._text[position]
+            if not self.started:
+                if char == "[":
+                    self.started = True
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = position
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    if char == "]":
+                        self.finished = True
+                        break
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._object_start is not None:
+                        try:
+                            completed.append(json.loads(self._text[self._object_start:position + 1]))
+                        except json.JSONDecodeError:
+                            pass
+                        self._object_start = None
+            position += 1
+
+        # Drop text that can no longer be part of an unfinished object
+        if self._object_start is None:
+            self._text = self._text[position:]
+            self._position = 0
+        else:
+            self._text = self._text[self._object_start:]
+            self._position = position - self._object_start
+            self._object_start = 0
+        return completed
+
+def validate_and_convert_json(json_input, type_of_question):
+
+    def is_valid_question(data):
+        if type_of_question == "multiple_choice":
+            return is_valid_multiple_choice_question(data)
+        elif type_of_question == "identification":
+            return is_valid_identification_question(data)
+        elif type_of_question == "true_false":
+            return is_valid_true_false_question(data)
+        else:
+            raise ValueError("type of question doesn't yet exist")  
+        return False
+
+    def is_valid_multiple_choice_question(data):
+        # Check for the presence of all required keys
+        return (
+            "question" in data and
+            "choices" in data and
+            "answer" in data and
+            "a" in data["choices"] and
+            "b" in data["choices"] and
+            "c" in data["choices"] and
+            "d" in data["choices"] and
+            isinstance(data["answer"], str) and
+            data["answer"] in ['a', 'b', 'c', 'd']
+        )
+    
+    def is_valid_identification_question(data):
+        return(
+            "question" in data and
+            "answer" in data
+        )
+    
+    def is_valid_true_false_question(data):
+        return (
+            "question" in data and
+            "answer" in data and 
+            isinstance(data["answer"], bool)  # Checks if the type of data["answer"] is boolean
+        )
+
+    # If the input is already a dictionary, validate it directly
+    if isinstance(json_input, dict):
+        valid = is_valid_question(json_input)
+        return json_input, valid
+    
+    # If it's a string, attempt to parse it as JSON
+    try:
+        data = json.loads(json_input)
+        valid = is_valid_question(data)
+        return data, valid
+    except (json.JSONDecodeError, TypeError) as e:
+        return None, False  # Return None and False if parsing fails or keys are missing
+
+
+PAGE_NUMBER_PATTERN = re.compile(r"^\s*(page\s*)?\d+(\s*(of|/)\s*\d+)?\s*$", re.IGNORECASE)
+REFERENCES_HEADING_PATTERN = re.compile(r"^\s*(references|bibliography|works cited|literature cited)\s*:?\s*$", re.IGNORECASE)
+# A line counts as a running header/footer when it shows up on at least this many pages and this share of them
+FURNITURE_MIN_PAGES = 3
+FURNITURE_PAGE_SHARE = 0.3
+# Running lines are detected from this many leading pages, so the rest of the document streams through
+FURNITURE_SAMPLE_PAGES = 50
+# Reference lists are only dropped when they start in the final part of a document
+REFERENCES_TAIL_SHARE = 0.25
+
+def _furniture_signature(line):
+    # Digits are masked so "Chapter 3 - Page 12" and "Chapter 3 - Page 13" count as the same running line
+    return re.sub(r"\d+", "#", line.strip().lower())
+
+def _repeated_line_signatures(sample_pages):
+    if len(sample_pages) < FURNITURE_MIN_PAGES:
+        return set()
+    pages_per_line = Counter()
+    for page in sample_pages:
+        pages_per_line.update({_furniture_signature(line) for line in page.split("\n") if sum(char.isalnum() for char in line) >= 3})
+    threshold = max(FURNITURE_MIN_PAGES, FURNITURE_PAGE_SHARE * len(sample_pages))
+    return {signature for signature, count in pages_per_line.items() if count >= threshold}
+
+def _has_references_heading(page):
+    return any(REFERENCES_HEADING_PATTERN.match(line) for line in page.split("\n"))
+
+def _clean_page(page, repeated_lines, stop_at_references=False):
+    kept_lines = []
+    for line in page.split("\n"):
+        if stop_at_references and REFERENCES_HEADING_PATTERN.match(line):
+            break
+        if line.strip() and (PAGE_NUMBER_PATTERN.match(line) or _furniture_signature(line) in repeated_lines):
+            continue
+        if line.strip() and kept_lines and line == kept_lines[-1]:
+            continue  # Same line twice in a row
+        kept_lines.append(line)
+    return "\n".join(kept_lines)
+
+def strip_page_furniture(pages):
+    # Drops running headers/footers, page numbers, repeated lines and a trailing reference list from one document's pages.
+    # Yields cleaned pages as they arrive; only the leading sample and pages after a possible reference heading are held
+    pages = iter(pages)
+    sample = [page for _, page in zip(range(FURNITURE_SAMPLE_PAGES), pages)]
+    repeated_lines = _repeated_line_signatures(sample)
+
+    # From a references heading on, pages are held until it is clear whether it starts the final REFERENCES_TAIL_SHARE of
+    # the document. Once too many pages have followed it, it was a mid-document heading, and a later one may still qualify
+    references_start = None
+    held = []
+    page_count = 0
+    for page_index, page in enumerate(itertools.chain(sample, pages)):
+        page_count = page_index + 1
+        if references_start is None:
+            if not _has_references_heading(page):
+                yield _clean_page(page, repeated_lines)
+                continue
+            references_start = page_index
+        held.append(page)
+        tail_start = int(page_count * (1 - REFERENCES_TAIL_SHARE))
+        while held and (references_start < tail_start or not _has_references_heading(held[0])):
+            yield _clean_page(held.pop(0), repeated_lines)
+            references_start += 1
+        if not held:
+            references_start = None
+
+    if held and page_count < FURNITURE_MIN_PAGES:
+        for page in held:
+            yield _clean_page(page, repeated_lines)
+    elif held:
+        yield _clean_page(held[0], repeated_lines, stop_at_references=True)
+
+def read_uploaded_files(files, strip_boilerplate=True, token_report=None, sources=None):
+    # token_report, when given, is a dict that receives the input tokens and the tokens stripped as boilerplate;
+    # sources, when given, is a list that receives (file name, end of its text in the content) for every file
+    raw_chars = 0
+
+    def count_chars(pages):
+        nonlocal raw_chars
+        for page in pages:
+            raw_chars += len(page)
+            yield page
+
+    with metrics.span("extract", files=len(files)) as extract_span:
+        document_texts = []
+        content_length = 0
+        for file in files:
+            pages = count_chars(iter_document_pages(file.getvalue(), file.type))
+            if strip_boilerplate:
+                pages = strip_page_furniture(pages)
+            document_texts.append("".join(pages))
+            content_length += len(document_texts[-1])
+            if sources is not None:
+                sources.append((file.name, content_length))
+        # Join once at the end instead of growing one string page by page
+        content = "".join(document_texts)
+        # Same arithmetic as estimate_tokens, without building a string the size of the raw text
+        tokens_saved = max(0, raw_chars // 4 + 1 - estimate_tokens(content)) if raw_chars else 0
+        extract_span["chars"] = len(content)
+        extract_span["boilerplate_tokens_saved"] = tokens_saved
+    metrics.increment("boilerplate_tokens_saved", tokens_saved)
+    if token_report is not None:
+        token_report["boilerplate_tokens_saved"] = token_report.get("boilerplate_tokens_saved", 0) + tokens_saved
+    return content
+
+# Define custom separators
+TEXT_SEPARATORS = ["\n\n", ". ", "\n•\n", "\n-\n", "\n", "\t"]
+CHUNK_SIZE = 8000  # Expected words for an 8k context length LLaMA3:8b model local
+CHUNK_OVERLAP = 200
+
+def _split_keeping_separator(text, separator):
+    # Every piece after the first starts with the separator it was split on, so joining them gives the text back
+    parts = re.split(f"({re.escape(separator)})", text) if separator else list(text)
+    if separator:
+        parts = [parts[0]] + [parts[i] + parts[i + 1] for i in range(1, len(parts) - 1, 2)]
+    return [part for part in parts if part]
+
+def _merge_splits(splits, chunk_size, chunk_overlap):
+    # Packs pieces into chunks of at most chunk_size characters; each chunk starts with up to chunk_overlap characters of the previous one
+    chunks = []
+    current = deque()
+    total = 0
+    for piece in splits:
+        if total + len(piece) > chunk_size and current:
+            chunk = "".join(current).strip()
+            if chunk:
+                chunks.append(chunk)
+            while total > chunk_overlap or (total + len(piece) > chunk_size and total > 0):
+                total -= len(current.popleft())
+        current.append(piece)
+        total += len(piece)
+    chunk = "".join(current).strip()
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def recursive_split(text, separators=TEXT_SEPARATORS, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    # Splits on the first separator found in the text and recurses into pieces still too long with the ones after it,
+    # the same chunks langchain's RecursiveCharacterTextSplitter(keep_separator=True) produced
+    separator = separators[-1]
+    remaining_separators = []
+    for i, candidate in enumerate(separators):
+        if candidate == "" or candidate in text:
+            separator = candidate
+            remaining_separators = separators[i + 1:]
+            break
+
+    chunks = []
+    short_pieces = []
+    for piece in _split_keeping_separator(text, separator):
+        if len(piece) < chunk_size:
+            short_pieces.append(piece)
+            continue
+        if short_pieces:
+            chunks.extend(_merge_splits(short_pieces, chunk_size, chunk_overlap))
+            short_pieces = []
+        if remaining_separators:
+            chunks.extend(recursive_split(piece, remaining_separators, chunk_size, chunk_overlap))
+        else:
+            chunks.append(piece)
+    if short_pieces:
+        chunks.extend(_merge_splits(short_pieces, chunk_size, chunk_overlap))
+    return chunks
+
+def split_text(content):
+    return recursive_split(content)
+
+def split_documents(content, sources=None):
+    # Splits every document of read_uploaded_files' sources on its own, so no chunk spans two of them.
+    # Returns the chunks and the name of the document each one came from (None without sources)
+    if not sources:
+        texts = split_text(content)
+        return texts, [None] * len(texts)
+    texts = []
+    chunk_sources = []
+    start = 0
+    for name, end in sources:
+        document_chunks = split_text(content[start:end])
+        texts.extend(document_chunks)
+        chunk_sources.extend([name] * len(document_chunks))
+        start = end
+    return texts, chunk_sources
+
+QUESTION_TYPES = ["multiple_choice", "identification", "true_false"]
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset("""
+    the and for are but not you all any can had her was one our out has him his how its may new now old see two way who
+    did get let say she too use that with have this will your from they know want been good much some time very when come
+    here just like long make many more only over such take than them well were what into also each which their there these
+    those would could should about after again other where while being because between through during before under
+""".split())
+# Weight applied to terms that also appear in the user's additional notes
+NOTE_TERM_BOOST = 3.0
+
+def tokenize_words(text):
+    return [word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 2 and word not in STOP_WORDS]
+
+def score_chunk_salience(texts, additional_note=""):
+    # Mean TF-IDF weight per word: dense, chunk-specific vocabulary scores high, boilerplate scores low.
+    # The mean is scaled down for chunks with fewer content words than the median chunk, so a sparse title page
+    # or reference list cannot outrank the body on a handful of rare terms
+    chunk_terms = [Counter(tokenize_words(text)) for text in texts]
+    document_frequency = Counter()
+    for terms in chunk_terms:
+        document_frequency.update(terms.keys())
+
+    num_chunks = len(texts)
+    note_terms = set(tokenize_words(additional_note or ""))
+    word_counts = sorted(sum(terms.values()) for terms in chunk_terms)
+    median_words = word_counts[len(word_counts) // 2] if word_counts else 0
+    scores = []
+    for terms in chunk_terms:
+        total_words = sum(terms.values())
+        if total_words == 0:
+            scores.append(0.0)
+            continue
+        score = 0.0
+        for term, count in terms.items():
+            weight = count * (math.log((1 + num_chunks) / (1 + document_frequency[term])) + 1)
+            if term in note_terms:
+                weight *= NOTE_TERM_BOOST
+            score += weight
+        scores.append(score / total_words * (min(1.0, total_words / median_words) if median_words else 1.0))
+    return scores
+
+def plan_chunks(texts, num_questions, additional_note=""):
+    # Returns [(chunk index, per-type question counts)] in document order. Every planned chunk gets at least one question.
+    total_questions = sum(num_questions[question_type] for question_type in QUESTION_TYPES)
+    if total_questions == 0 or not texts:
+        return []
+
+    scores = score_chunk_salience(texts, additional_note)
+    num_selected = min(len(texts), total_questions)
+
+    # Take the most salient chunk from each of num_selected equal spans so questions cover the whole document
+    selected = []
+    for span in range(num_selected):
+        start = span * len(texts) // num_selected
+        stop = (span + 1) * len(texts) // num_selected
+        selected.append(max(range(start, stop), key=lambda i: scores[i]))
+
+    # Deal questions round-robin from the most to the least salient chunk, so the richest chunks absorb any remainder
+    ranked = sorted(selected, key=lambda i: scores[i], reverse=True)
+    plan = {i: {question_type: 0 for question_type in QUESTION_TYPES} for i in selected}
+    position = 0
+    for question_type in QUESTION_TYPES:
+        for _ in range(num_questions[question_type]):
+            plan[ranked[position % num_selected]][question_type] += 1
+            position += 1
+
+    return [(i, plan[i]) for i in selected]
+
+# Gemini 1.5 Flash accepts about a million input tokens; backends report their own limit through context_tokens
+GEMINI_CONTEXT_TOKENS = 1048576
+# Lets a deployment cap request size below the model limit, e.g. to keep several requests running side by side
+REQUEST_TOKEN_BUDGET = int(os.getenv("STUDY_QUEST_REQUEST_TOKEN_BUDGET", "0")) or None
+# Room kept in every request for the instructions around the text and for the answer itself
+PROMPT_OVERHEAD_TOKENS = 600
+OUTPUT_TOKENS_PER_QUESTION = 150
+# Gemini stops at 8192 output tokens, so a single request never asks for more than this
+MAX_QUESTIONS_PER_REQUEST = 40
+
+def get_request_token_budget(api_key=None):
+    context_tokens = getattr(get_group_model(api_key), "context_tokens", GEMINI_CONTEXT_TOKENS)
+    if REQUEST_TOKEN_BUDGET is not None:
+        return min(context_tokens, REQUEST_TOKEN_BUDGET)
+    return context_tokens
+
+def pack_requests(texts, planned_chunks, token_budget, max_chunks_per_request=None, chunk_sources=None):
+    # First-fit decreasing over the planned chunks: each request holds as many chunks as its text and expected
+    # answers fit in token_budget, and at most max_chunks_per_request of them. With chunk_sources, a request
+    # only holds chunks of one document, so its questions can be credited to that document.
+    # Returns [(first chunk index, joined text, per-type question counts)] in document order.
+    def chunk_cost(planned_chunk):
+        i, group_questions = planned_chunk
+        return estimate_tokens(texts[i]) + OUTPUT_TOKENS_PER_QUESTION * sum(group_questions.values())
+
+    capacity = token_budget - PROMPT_OVERHEAD_TOKENS
+    requests_planned = []
+    for planned_chunk in sorted(planned_chunks, key=chunk_cost, reverse=True):
+        cost = chunk_cost(planned_chunk)
+        chunk_questions = sum(planned_chunk[1].values())
+        for request in requests_planned:
+            if (request["cost"] + cost <= capacity and request["questions"] + chunk_questions <= MAX_QUESTIONS_PER_REQUEST
+                    and (max_chunks_per_request is None or len(request["chunks"]) < max_chunks_per_request)
+                    and (chunk_sources is None or chunk_sources[request["chunks"][0][0]] == chunk_sources[planned_chunk[0]])):
+                break
+        else:
+            # A chunk too large for the budget on its own still gets a request of its own
+            request = {"cost": 0, "questions": 0, "chunks": []}
+            requests_planned.append(request)
+        request["cost"] += cost
+        request["questions"] += chunk_questions
+        request["chunks"].append(planned_chunk)
+
+    packed = []
+    for request in requests_planned:
+        chunks = sorted(request["chunks"], key=lambda planned_chunk: planned_chunk[0])
+        group_questions = {question_type: sum(counts[question_type] for _, counts in chunks) for question_type in QUESTION_TYPES}
+        packed.append((chunks[0][0], "\n\n".join(texts[i] for i, _ in chunks), group_questions))
+    packed.sort(key=lambda request: request[0])
+    return packed
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+def compress_text(text, target_tokens, additional_note=""):
+    # Extractive compression: keep the sentences richest in the text's recurring content words (and the note's terms)
+    # until target_tokens is reached, then put them back in their original order
+    if estimate_tokens(text) <= target_tokens:
+        return text
+    sentences = [sentence for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+    word_frequency = Counter(tokenize_words(text))
+    note_terms = set(tokenize_words(additional_note or ""))
+
+    scores = []
+    for sentence in sentences:
+        words = tokenize_words(sentence)
+        if not words:
+            scores.append(0.0)
+            continue
+        scores.append(sum(word_frequency[word] * (NOTE_TERM_BOOST if word in note_terms else 1.0) for word in words) / len(words))
+
+    kept = []
+    used_tokens = 0
+    for position in sorted(range(len(sentences)), key=lambda position: scores[position], reverse=True):
+        sentence_tokens = estimate_tokens(sentences[position])
+        if used_tokens + sentence_tokens > target_tokens:
+            continue
+        kept.append(position)
+        used_tokens += sentence_tokens
+    if not kept:
+        if not sentences:
+            return text
+        # No sentence fits on its own, so send the start of the most salient one rather than nothing
+        best_sentence = sentences[max(range(len(sentences)), key=lambda position: scores[position])]
+        return best_sentence[:target_tokens * 4].strip() or best_sentence
+    return " ".join(sentences[position] for position in sorted(kept))
+
+QUESTION_FORMATS = {
+    "multiple_choice": """{{
+        "type_of_test":"multiple_choice",
+        "question":<question>,
+        "choices":{{
+            "a":<choice a>,
+            "b":<choice b>,
+            "c":<choice c>,
+            "d":<choice d>
+        }},
+        "answer":<answer in small letter>
+    }}""",
+    "identification": """{{
+        "type_of_test":"identification",
+        "question":<question>,
+        "answer": <answer>
+    }}""",
+    "true_false": """{{
+        "type_of_test":"true_false",
+        "question":<question>,
+        "answer": <boolean>
+    }}"""
+}
+QUESTION_TYPE_NAMES = {
+    "multiple_choice": "multiple choice",
+    "identification": "identification",
+    "true_false": "true or false"
+}
+
+def build_typed_prompt(text, type_of_test, num_questions, additional_note):
+    question_format = QUESTION_FORMATS[type_of_test].format()
+    prompt = f"""
+    Given the following text/content:
+    ----------------------
+    {text}
+    ----------------------
+
+    Generate me {num_questions} {QUESTION_TYPE_NAMES[type_of_test]} questions as a JSON array. Please strictly follow the format below for every question!!!:
+
+    ```json
+    [
+    {question_format}
+    ]
+    ```
+
+    Additional Notes: {additional_note}
+    """
+    return prompt
+
+def generate_typed_questions(text, type_of_test, num_questions, starting_number, additional_note, backend=None, max_attempts=3, session_id="default"):
+    # Several questions of one type per call, with a bounded number of top-up calls for whatever fails validation
+    if backend is None:
+        backend = get_ollama_backend()
+    requested = {question_type: 0 for question_type in QUESTION_TYPES}
+    requested[type_of_test] = num_questions
+    accepted_counts = {question_type: 0 for question_type in QUESTION_TYPES}
+    accepted_questions = []
+
+    while accepted_counts[type_of_test] < num_questions and max_attempts > 0:
+        prompt = build_typed_prompt(text, type_of_test, num_questions - accepted_counts[type_of_test], additional_note)
+        for item in request_question_items(backend, prompt, stream=False, session_id=session_id):
+            if isinstance(item, dict):
+                item["type_of_test"] = type_of_test
+            if accept_question(item, accepted_counts, requested):
+                accepted_questions.append(item)
+        max_attempts = max_attempts - 1
+        if accepted_counts[type_of_test] < num_questions:
+            logger.warning("Got %s of %s %s questions starting at number %s", accepted_counts[type_of_test], num_questions, type_of_test, starting_number)
+
+    #Populate the question json format
+    questions = []
+    for question_number, item in enumerate(accepted_questions, start=starting_number):
+        question = {
+            "question_number":f"{question_number}",
+            "type_of_test":f"{type_of_test}",
+            "question":item["question"]
+        }
+        if type_of_test == "multiple_choice":
+            question["choices"] = item["choices"]
+        question["answer"] = item["answer"]
+        questions.append(question)
+    return questions
+
+def generate_a_multiple_question(text, starting_number, type_of_test, additional_note, backend=None):
+    questions = generate_typed_questions(text, type_of_test, 1, starting_number, additional_note, backend=backend)
+    return questions[0] if questions else None
+
+def generate_an_identification_question(text, starting_number, type_of_test, additional_note, backend=None):
+    questions = generate_typed_questions(text, type_of_test, 1, starting_number, additional_note, backend=backend)
+    return questions[0] if questions else None
+
+def generate_a_true_false_question(text, starting_number, type_of_test, additional_note, backend=None):
+    questions = generate_typed_questions(text, type_of_test, 1, starting_number, additional_note, backend=backend)
+    return questions[0] if questions else None
+
+def build_group_prompt(text, num_questions, additional_note):
+    prompt = f"""
+    Given the following academic text below, I'd like you to generate some questions on different types of test.
+
+    Academic text:
+
+    {text}
+    --------------------------------
+    
+    I'd like you to generate these types of test of questions with the corresponding number of questions for each type of text:
+    1) Identification: {num_questions["identification"]} questions
+    2) Multiple Choice: {num_questions["multiple_choice"]} questions
+    3) True or False: {num_questions["true_false"]} questions
+
+    Note: The arrangement of the type of test should be random
+
+    Please give your output or answer using the example following json format:
+
+    ```json
+    [
+        {{
+        "type_of_test":"identification",
+        "question":<question>,
+        "answer": <answer>
+        }},
+        {{
+        "type_of_test":"true_false",
+        "question":<question>,
+        "answer": <boolean>
+        }},
+        {{
+        "type_of_test":"multiple_choice",
+        "question":<question>,
+        "choices":{{
+            "a":<choice a>,
+            "b":<choice b>,
+            "c":<choice c>,
+            "d":<choice d>
+            }}
+        "answer": <letter only in (lowercase letter)>
+        }}
+    ]
+    ```json
+
+    Notes:
+    - You can generate the type of test of the questions in no particular order as long as you generated the required number of questions per type of test.
+    - Double check the accuracy of the answers of the questions based on the academic text or content.
+    
+    Additional Notes:
+    {additional_note}
+    """
+    return prompt
+
+# Replaces genai.GenerativeModel when set, e.g. with the fake model in Study_Quest_AI_Benchmark.
+# Called as model_factory(model_name, generation_config, api_key) and must return an object with generate_content()
+model_factory = None
+
+def set_model_factory(factory):
+    global model_factory
+    previous_factory = model_factory
+    model_factory = factory
+    return previous_factory
+
+# Configured models shared by every session for the life of the process, keyed by (api key, model, generation config).
+# Each model keeps its own API client, so its connection stays warm across chunks, generations and reruns.
+_model_pool = {}
+_model_pool_lock = threading.Lock()
+
+def model_identity():
+    # What a cached response depends on besides the prompt inputs
+    if MODEL_BACKEND == "ollama":
+        return "ollama", get_ollama_backend().model
+    return MODEL_NAME, GENERATION_CONFIG
+
+def get_group_model(api_key=None, model_name=MODEL_NAME, generation_config=None):
+    if generation_config is None:
+        generation_config = GENERATION_CONFIG
+    if model_factory is not None:
+        return model_factory(model_name, generation_config, api_key)
+    if MODEL_BACKEND == "ollama":
+        return get_ollama_backend()
+    if api_key is None:
+        api_key = get_api_key()
+
+    pool_key = (api_key, model_name, json.dumps(generation_config, sort_keys=True))
+    with _model_pool_lock:
+        model = _model_pool.get(pool_key)
+        if model is None:
+            import google.generativeai as genai  # Deferred, importing the SDK alone takes about half a second
+            from google.generativeai import client as genai_client
+            # genai.configure swaps process-wide client settings, so bind the model to its client while the lock is held
+            genai.configure(api_key=api_key)
+            # Choose a model that's appropriate for your use case.
+            model = genai.GenerativeModel(model_name,
+                generation_config=genai.GenerationConfig(**generation_config))
+            model._client = genai_client.get_default_generative_client()
+            _model_pool[pool_key] = model
+    return model
+
+def parse_question_items(response_text):
+    parsed_result, response_json_valid = extract_and_parse_json(response_text)
+    if response_json_valid and isinstance(parsed_result, list):
+        return parsed_result
+    # Salvage every complete object from a truncated or partly malformed array
+    return IncrementalJSONArrayParser().feed(response_text)
+
+def accept_question(item, accepted_counts, num_questions, dedup_index=None):
+    # Per-item validation; also refuses items beyond what was asked for of their type and near-duplicates
+    if not isinstance(item, dict):
+        return False
+    type_of_test = item.get("type_of_test")
+    if type_of_test not in QUESTION_TYPES or accepted_counts[type_of_test] >= num_questions[type_of_test]:
+        return False
+    _, valid = validate_and_convert_json(item, type_of_test)
+    if not valid:
+        return False
+    if dedup_index is not None and dedup_index.add(item) is not None:
+        return False
+    accepted_counts[type_of_test] += 1
+    return True
+
+def _record_token_usage(request_span, response, estimated_tokens):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    request_span["prompt_tokens"] = prompt_tokens
+    request_span["response_tokens"] = response_tokens
+    metrics.increment("prompt_tokens", prompt_tokens)
+    metrics.increment("response_tokens", response_tokens)
+    # The scheduler charged an estimate up front; settle it against what the request really used
+    get_scheduler().charge_tokens(prompt_tokens + response_tokens - estimated_tokens)
+
+def request_question_items(model, prompt, stream, chunk_number=None, session_id="default"):
+    metrics.increment("requests")
+    scheduler = get_scheduler()
+    estimated_tokens = estimate_tokens(prompt)
+    if not stream:
+        with metrics.span("request", chunk=chunk_number, stream=False, prompt_chars=len(prompt)) as request_span:
+            response = scheduler.call(model.generate_content, prompt, session_id=session_id, estimated_tokens=estimated_tokens)
+            response_text = response.text
+            request_span["response_chars"] = len(response_text)
+            _record_token_usage(request_span, response, estimated_tokens)
+        with metrics.span("parse", chunk=chunk_number, response_chars=len(response_text)):
+            items = parse_question_items(response_text)
+        yield from items
+        return
+
+    # Streaming interleaves parsing with the response, so the request span runs until the last piece arrives
+    parser = IncrementalJSONArrayParser()
+    parse_seconds = 0.0
+    response_chars = 0
+    with metrics.span("request", chunk=chunk_number, stream=True, prompt_chars=len(prompt)) as request_span:
+        last_response_chunk = None
+        for response_chunk in scheduler.call(model.generate_content, prompt, stream=True, session_id=session_id, estimated_tokens=estimated_tokens):
+            last_response_chunk = response_chunk
+            response_chars += len(response_chunk.text)
+            parse_start = time.perf_counter()
+            items = parser.feed(response_chunk.text)
+            parse_seconds += time.perf_counter() - parse_start
+            yield from items
+        request_span["response_chars"] = response_chars
+        _record_token_usage(request_span, last_response_chunk, estimated_tokens)  # Usage on the final piece covers the whole response
+    metrics.add_span("parse", parse_seconds, chunk=chunk_number, response_chars=response_chars)
+
+def iter_group_questions(text, num_questions, additional_note, chunk_number, api_key=None, fresh=False, stream=True, dedup_index=None, session_id="default"):
+    cache_key = make_cache_key(text, num_questions, additional_note, *model_identity())
+    accepted_questions = []
+    accepted_counts = {question_type: 0 for question_type in QUESTION_TYPES}
+
+    # Cached questions go through the same checks, so a duplicate of another chunk is replaced rather than repeated
+    cached_result = None if fresh else response_cache.get_json(cache_key)
+    if cached_result is not None:
+        logger.info("Using cached questions for chunk text group %s", chunk_number)
+        metrics.increment("cache_hits")
+        for item in cached_result:
+            if accept_question(item, accepted_counts, num_questions, dedup_index):
+                accepted_questions.append(item)
+                yield item
+    else:
+        metrics.increment("cache_misses")
+
+    missing_questions = {question_type: num_questions[question_type] - accepted_counts[question_type] for question_type in QUESTION_TYPES}
+    if not any(missing_questions.values()):
+        return
+
+    logger.debug("Generating questions for chunk text group %s: %s", chunk_number, missing_questions)
+    model = get_group_model(api_key)
+
+    max_attempts = 3
+    while any(missing_questions.values()) and max_attempts > 0:
+        # Only the shortfall is re-requested, questions already accepted are kept
+        prompt = build_group_prompt(text, missing_questions, additional_note)
+        rejected_items = 0
+        validated_items = 0
+        validate_seconds = 0.0
+        for item in request_question_items(model, prompt, stream, chunk_number, session_id):
+            validate_start = time.perf_counter()
+            accepted = accept_question(item, accepted_counts, num_questions, dedup_index)
+            validate_seconds += time.perf_counter() - validate_start
+            validated_items += 1
+            if accepted:
+                accepted_questions.append(item)
+                yield item
+            else:
+                rejected_items += 1
+        metrics.add_span("validate", validate_seconds, chunk=chunk_number, items=validated_items, rejected=rejected_items)
+        metrics.increment("rejected_items", rejected_items)
+        missing_questions = {question_type: num_questions[question_type] - accepted_counts[question_type] for question_type in QUESTION_TYPES}
+        max_attempts = max_attempts - 1
+        if any(missing_questions.values()) and max_attempts > 0:
+            logger.warning("Chunk text group %s is short of %s (%s items rejected)... Topping up...", chunk_number, missing_questions, rejected_items)
+            metrics.increment("retries")
+
+    logger.debug("Accepted %s questions for chunk text group %s", len(accepted_questions), chunk_number)
+    if not any(missing_questions.values()):
+        response_cache.put_json(cache_key, accepted_questions)
+
+def generate_questions_for_group(text, num_questions, additional_note, chunk_number, api_key=None, fresh=False, dedup_index=None, session_id="default"):
+    return list(iter_group_questions(text, num_questions, additional_note, chunk_number, api_key, fresh, stream=False, dedup_index=dedup_index, session_id=session_id))
+
+def stream_questions_for_group(text, num_questions, additional_note, chunk_number, api_key=None, fresh=False, dedup_index=None, session_id="default"):
+    # Same contract as generate_questions_for_group, but yields each question as soon as its object is complete
+    yield from iter_group_questions(text, num_questions, additional_note, chunk_number, api_key, fresh, stream=True, dedup_index=dedup_index, session_id=session_id)
+
+def _run_group_into_queue(results_queue, chunk_number, cancel_event, group_function, *args):
+    try:
+        # Requests already sent run to completion, but queued chunks are dropped once the run is cancelled
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled("Generation cancelled")
+        for question in group_function(*args) or []:
+            results_queue.put((chunk_number, question, None))
+    except Exception as e:
+        results_queue.put((chunk_number, None, e))
+    finally:
+        results_queue.put((chunk_number, _GROUP_DONE, None))
+
+def iter_generate_questions(content, num_questions, additional_note, max_concurrent_requests=MAX_CONCURRENT_REQUESTS, fresh=False, stream=True, dedup_index=None, api_key=None, session_id="default",
+                            compression_ratio=1.0, token_report=None, completed_chunks=(), on_plan=None, on_chunk_done=None, cancel_event=None, sources=None):
+    # Yields (chunk number, question) in arrival order while chunks are generated concurrently.
+    # Chunks listed in completed_chunks are planned as usual but not requested again; on_plan gets every planned
+    # chunk number and on_chunk_done each chunk number whose questions have all been yielded.
+    # With read_uploaded_files' sources, every question carries the name of its document as "source"
+    with metrics.span("split", chars=len(content)) as split_span:
+        texts, chunk_sources = split_documents(content, sources)
+        split_span["chunks"] = len(texts)
+
+    # Resolve the key once here rather than in every worker
+    if api_key is None:
+        api_key = get_api_key()
+
+    # Plan every chunk's share up front so the per-type totals hold no matter which request finishes first
+    planned_groups = []
+    with metrics.span("plan", chunks=len(texts)) as plan_span:
+        planned_chunks = plan_chunks(texts, num_questions, additional_note)
+        # Packing stops short of what the context allows so requests still fan out across the workers and
+        # a failed or interrupted request costs only its share of the chunks
+        max_chunks_per_request = math.ceil(len(planned_chunks) / max(1, max_concurrent_requests)) or None
+        for i, text, group_questions in pack_requests(texts, planned_chunks, get_request_token_budget(api_key), max_chunks_per_request, chunk_sources):
+            logger.debug("Text group %s: %s", i, group_questions)
+            planned_groups.append((i, text, group_questions))
+        plan_span["planned_chunks"] = len(planned_chunks)
+        plan_span["requests"] = len(planned_groups)
+
+    # Optional extractive compression of every request's text down to compression_ratio of its tokens
+    input_tokens = sum(estimate_tokens(text) for _, text, _ in planned_groups)
+    if compression_ratio < 1.0:
+        with metrics.span("compress", tokens=input_tokens) as compress_span:
+            # A request is never sent without source text, whatever the compression leaves
+            planned_groups = [
+                (i, compress_text(text, max(1, int(estimate_tokens(text) * compression_ratio)), additional_note).strip() or text, group_questions)
+                for i, text, group_questions in planned_groups
+            ]
+            compressed_tokens = sum(estimate_tokens(text) for _, text, _ in planned_groups)
+            compress_span["tokens_saved"] = input_tokens - compressed_tokens
+        metrics.increment("compression_tokens_saved", input_tokens - compressed_tokens)
+    else:
+        compressed_tokens = input_tokens
+    if token_report is not None:
+        token_report["input_tokens"] = compressed_tokens
+        token_report["compression_tokens_saved"] = input_tokens - compressed_tokens
+
+    if on_plan is not None:
+        on_plan([i for i, _, _ in planned_groups])
+    planned_groups = [group for group in planned_groups if group[0] not in completed_chunks]
+    if not planned_groups:
+        return
+
+    group_function = stream_questions_for_group if stream else generate_questions_for_group
+    results_queue = queue.Queue()
+    max_workers = max(1, min(max_concurrent_requests, len(planned_groups)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i, text, group_questions in planned_groups:
+            # Workers run in a copy of this context so they report to the same active instrumentation
+            executor.submit(contextvars.copy_context().run, _run_group_into_queue, results_queue, i, cancel_event, group_function, text, group_questions, additional_note, i, api_key, fresh, dedup_index, session_id)
+
+        # A failed chunk does not stop the others; the first error is raised once every chunk has settled
+        failed_chunks = {}
+        groups_remaining = len(planned_groups)
+        while groups_remaining:
+            chunk_number, question, error = results_queue.get()
+            if error is not None:
+                failed_chunks[chunk_number] = error
+                continue
+            if question is _GROUP_DONE:
+                groups_remaining -= 1
+                if chunk_number not in failed_chunks and on_chunk_done is not None:
+                    on_chunk_done(chunk_number)
+                continue
+            if chunk_sources[chunk_number] is not None:
+                question["source"] = chunk_sources[chunk_number]
+            yield chunk_number, question
+
+    if failed_chunks:
+        errors = list(failed_chunks.values())
+        metrics.increment("failed_chunks", len(errors))
+        raise next((error for error in errors if not isinstance(error, GenerationCancelled)), errors[0])
+
+def generate_questions(content, num_questions, additional_note, max_concurrent_requests=MAX_CONCURRENT_REQUESTS, fresh=False, stream=True, on_question=None, dedupe=True, existing_questions=None, api_key=None, starting_question_number=1, session_id="default",
+                       compression_ratio=1.0, token_report=None, completed_chunks=None, on_plan=None, on_chunk_done=None, cancel_event=None, sources=None):
+    # completed_chunks maps chunk numbers to questions from an earlier, interrupted run of the same request;
+    # those chunks are reused instead of generated again. on_plan gets the planned chunk numbers and
+    # on_chunk_done(chunk_number, questions) fires as each new chunk finishes
+    completed_chunks = completed_chunks or {}
+    # One index is shared by every chunk worker; seeding it with an existing bank keeps new questions from repeating it
+    known_questions = list(existing_questions or [])
+    for questions in completed_chunks.values():
+        known_questions.extend(questions)
+    dedup_index = build_dedup_index(known_questions) if dedupe else None
+
+    # Results are slotted by chunk index so the final order never depends on completion order
+    group_results = {}
+    questions_received = 0
+
+    def restore_completed_chunks(planned_chunk_numbers):
+        # Only chunks that are still part of the plan are reused
+        nonlocal questions_received
+        if on_plan is not None:
+            on_plan(planned_chunk_numbers)
+        for chunk_number in planned_chunk_numbers:
+            for question in completed_chunks.get(chunk_number, []):
+                group_results.setdefault(chunk_number, []).append(question)
+                questions_received += 1
+                if on_question is not None:
+                    on_question(question, questions_received)
+
+    def finish_chunk(chunk_number):
+        if on_chunk_done is not None:
+            on_chunk_done(chunk_number, group_results.get(chunk_number, []))
+
+    with metrics.span("generate", requested=sum(num_questions[question_type] for question_type in QUESTION_TYPES)) as generate_span:
+        for chunk_number, question in iter_generate_questions(content, num_questions, additional_note, max_concurrent_requests, fresh, stream, dedup_index, api_key, session_id,
+                                                                 compression_ratio, token_report, completed_chunks, restore_completed_chunks, finish_chunk, cancel_event, sources):
+            group_results.setdefault(chunk_number, []).append(question)
+            questions_received += 1
+            if on_question is not None:
+                on_question(question, questions_received)
+        generate_span["questions"] = questions_received
+        generate_span["reused_chunks"] = len(completed_chunks)
+
+    all_questions = []
+    for chunk_number in sorted(group_results):
+        all_questions.extend(group_results[chunk_number])
+
+    for question_number, question in enumerate(all_questions, start=starting_question_number):
+        question["question_number"] = f"{question_number}"
+
+    logger.info("Generated %s questions", len(all_questions))
+    return all_questions
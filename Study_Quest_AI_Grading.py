@@ -0,0 +1,120 @@
+"""Batch grading of quiz attempts.
+
+Answers are graded as columns: one attempt or thousands of stored ones go through the same pandas
+merge and comparisons, and identification answers are fuzzy-matched once per distinct answer pair.
+
+    graded = grade_attempts(questions, {"attempt-1": {0: "b", 1: True, 2: "mitochondira"}})
+    scores = score_attempts(graded)
+"""
+from rapidfuzz import fuzz
+import pandas as pd
+import re
+
+
+# Identification answers at or above this similarity (0-100) count as correct
+IDENTIFICATION_THRESHOLD = 85
+# Answers this short have to match exactly, since one typo already changes what they mean
+MIN_FUZZY_LENGTH = 4
+
+ANSWER_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+LEADING_ARTICLE_PATTERN = re.compile(r"^(the|a|an)\s+")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+GRADED_COLUMNS = ["attempt_id", "question_index", "type_of_test", "user_answer", "correct_answer", "similarity", "correct"]
+
+
+def normalize_answer(answer):
+    if answer is None:
+        return ""
+    text = ANSWER_PUNCTUATION_PATTERN.sub(" ", str(answer).lower())
+    text = " ".join(text.split())
+    return LEADING_ARTICLE_PATTERN.sub("", text)
+
+
+def to_boolean_answer(answer):
+    # Imported banks and stored attempts may carry true/false answers as strings
+    if isinstance(answer, bool):
+        return answer
+    if isinstance(answer, str) and answer.strip().lower() in ("true", "false"):
+        return answer.strip().lower() == "true"
+    return None
+
+
+def identification_similarity(user_answer, correct_answer):
+    # Both answers already normalized. Returns a 0-100 score: character similarity, or word-order-insensitive
+    # similarity for multi-word answers, whichever is higher. Numbers (dates, amounts) must match exactly
+    if user_answer == correct_answer:
+        return 100.0
+    if not user_answer or not correct_answer:
+        return 0.0
+    if DIGITS_PATTERN.findall(user_answer) != DIGITS_PATTERN.findall(correct_answer):
+        return 0.0
+    if min(len(user_answer), len(correct_answer)) < MIN_FUZZY_LENGTH:
+        return 0.0
+    return max(fuzz.ratio(user_answer, correct_answer), fuzz.token_sort_ratio(user_answer, correct_answer))
+
+
+def questions_frame(questions, question_indexes=None):
+    if question_indexes is None:
+        question_indexes = range(len(questions))
+    # question_index is int64 on both sides of the merge, even when there are no rows to infer it from
+    return pd.DataFrame({
+        "question_index": pd.Series(list(question_indexes), dtype="int64"),
+        "type_of_test": [questions[idx].get("type_of_test") for idx in question_indexes],
+        "correct_answer": [questions[idx].get("answer") for idx in question_indexes]
+    })
+
+
+def attempts_frame(attempts):
+    # attempts is {attempt_id: {question_index: answer}}, or already a frame with attempt_id, question_index and user_answer
+    if isinstance(attempts, pd.DataFrame):
+        return attempts[["attempt_id", "question_index", "user_answer"]].astype({"question_index": "int64"})
+    rows = [(attempt_id, int(question_index), answer) for attempt_id, answers in attempts.items() for question_index, answer in answers.items()]
+    return pd.DataFrame(rows, columns=["attempt_id", "question_index", "user_answer"]).astype({"question_index": "int64"})
+
+
+def grade_attempts(questions, attempts, identification_threshold=IDENTIFICATION_THRESHOLD, question_indexes=None):
+    # One row per attempt and question; questions an attempt did not answer are graded as wrong.
+    # question_indexes limits grading to those questions, e.g. the ones a review session showed
+    question_rows = questions_frame(questions, question_indexes)
+    answer_rows = attempts_frame(attempts)
+    attempt_ids = pd.DataFrame({"attempt_id": pd.Series(list(attempts.keys()) if isinstance(attempts, dict) else pd.unique(answer_rows["attempt_id"]), dtype=object)})
+    graded = attempt_ids.merge(question_rows, how="cross").merge(answer_rows, on=["attempt_id", "question_index"], how="left")
+    graded["user_answer"] = graded["user_answer"].astype(object).where(graded["user_answer"].notna(), None)
+    graded["similarity"] = 0.0
+
+    multiple_choice = graded["type_of_test"] == "multiple_choice"
+    graded.loc[multiple_choice, "similarity"] = (
+        graded.loc[multiple_choice, "user_answer"].map(normalize_answer) == graded.loc[multiple_choice, "correct_answer"].map(normalize_answer)
+    ) * 100.0
+
+    true_false = graded["type_of_test"] == "true_false"
+    user_booleans = graded.loc[true_false, "user_answer"].map(to_boolean_answer)
+    correct_booleans = graded.loc[true_false, "correct_answer"].map(to_boolean_answer)
+    graded.loc[true_false, "similarity"] = (user_booleans.notna() & (user_booleans == correct_booleans)) * 100.0
+
+    identification = graded["type_of_test"] == "identification"
+    if identification.any():
+        pairs = pd.DataFrame({
+            "user": graded.loc[identification, "user_answer"].map(normalize_answer),
+            "correct": graded.loc[identification, "correct_answer"].map(normalize_answer)
+        })
+        # Stored attempts repeat the same answers a lot, so each distinct pair is scored once
+        unique_pairs = pairs.drop_duplicates()
+        unique_pairs["similarity"] = [identification_similarity(user, correct) for user, correct in zip(unique_pairs["user"], unique_pairs["correct"])]
+        graded.loc[identification, "similarity"] = pairs.merge(unique_pairs, on=["user", "correct"], how="left")["similarity"].to_numpy()
+
+    graded["correct"] = graded["similarity"] >= identification_threshold
+    graded.loc[~identification, "correct"] = graded.loc[~identification, "similarity"] >= 100.0
+    return graded[GRADED_COLUMNS]
+
+
+def grade_attempt(questions, user_answers, identification_threshold=IDENTIFICATION_THRESHOLD, question_indexes=None):
+    # A single attempt as {question_index: answer}, e.g. the quiz page's user_answers
+    return grade_attempts(questions, {"attempt": user_answers}, identification_threshold, question_indexes).drop(columns="attempt_id")
+
+
+def score_attempts(graded):
+    scores = graded.groupby("attempt_id", sort=False)["correct"].agg(score="sum", total="count").reset_index()
+    scores["percent"] = scores["score"] / scores["total"].clip(lower=1) * 100
+    return scores
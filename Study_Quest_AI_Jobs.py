@@ -0,0 +1,243 @@
+"""Background generation jobs, shared across sessions and checkpointed per chunk.
+
+A job runs generate_questions on its own thread and is identified by a key derived from everything its
+result depends on. Identical requests from other sessions attach to the running job instead of starting
+another one. Every finished chunk is appended to a checkpoint file, so a job that fails, is cancelled or
+dies with the process is resumed by submitting the same request again; only unfinished chunks are sent.
+"""
+from Study_Quest_AI_Functions import MAX_CONCURRENT_REQUESTS, QUESTION_TYPES, GenerationCancelled, generate_questions, model_identity
+from Study_Quest_AI_Cache import CACHE_ROOT, make_cache_key
+import Study_Quest_AI_Metrics as metrics
+import contextvars
+import threading
+import logging
+import copy
+import json
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+JOBS_ROOT = os.path.join(CACHE_ROOT, "jobs")
+# Checkpoints of jobs nobody resumed within a week are deleted
+CHECKPOINT_MAX_AGE = 7 * 24 * 3600
+
+
+class GenerationJobRunning(Exception):
+    pass
+
+
+class JobCheckpoint:
+    """Append-only JSONL file with one line per finished chunk, flushed to disk as each chunk completes."""
+
+    def __init__(self, job_id, directory=JOBS_ROOT):
+        self.path = os.path.join(directory, f"{job_id}.jsonl")
+        self._lock = threading.Lock()
+
+    def load(self):
+        completed_chunks = {}
+        if not os.path.exists(self.path):
+            return completed_chunks
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # A line cut off by a crash
+                completed_chunks[int(entry["chunk"])] = entry["questions"]
+        return completed_chunks
+
+    def append(self, chunk_number, questions):
+        line = json.dumps({"chunk": chunk_number, "questions": questions}, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def prune_checkpoints(directory=JOBS_ROOT, max_age=CHECKPOINT_MAX_AGE):
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass  # Removed concurrently
+
+
+class GenerationJob:
+    """One background generate_questions run that any number of sessions can follow.
+
+    status is "running", "completed", "failed" or "cancelled".
+    """
+
+    def __init__(self, job_id, checkpoint):
+        self.job_id = job_id
+        self.checkpoint = checkpoint
+        self.status = "running"
+        self.questions = []
+        self.token_report = {}
+        self.chunks_total = None
+        self.chunks_done = 0
+        self.chunks_reused = 0
+        self.result = None
+        self.error = None
+        self.done = False
+        self.waiters = 1
+        self.cancel_event = threading.Event()
+        self.started = time.time()
+        self.saved_banks = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def add_question(self, question, questions_received):
+        with self._lock:
+            self.questions.append(question)
+
+    def set_plan(self, chunk_numbers, completed_chunks):
+        with self._lock:
+            self.chunks_total = len(chunk_numbers)
+            self.chunks_reused = sum(1 for chunk_number in chunk_numbers if chunk_number in completed_chunks)
+            self.chunks_done = self.chunks_reused
+
+    def complete_chunk(self, chunk_number, questions):
+        self.checkpoint.append(chunk_number, questions)
+        with self._lock:
+            self.chunks_done += 1
+
+    def finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.done = True
+
+    def progress(self):
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "chunks_done": self.chunks_done,
+                "chunks_total": self.chunks_total,
+                "chunks_reused": self.chunks_reused,
+                "questions": len(self.questions),
+                "elapsed_seconds": time.time() - self.started
+            }
+
+    def save_bank(self, owner, save):
+        # The first session of each owner to pick up the result calls save() and the bank_id it returns is
+        # handed to every other session of that owner, so a shared job is saved once rather than once per session
+        with self._save_lock:
+            if owner not in self.saved_banks:
+                self.saved_banks[owner] = save()
+            return self.saved_banks[owner]
+
+    def get_result(self):
+        if not self.done:
+            raise RuntimeError(f"Generation job {self.job_id} is still running")
+        if self.error is not None:
+            raise self.error
+        # Every session edits its own quiz, so nobody gets the shared dicts
+        return copy.deepcopy(self.result)
+
+
+class JobRegistry:
+    def __init__(self, checkpoint_dir=JOBS_ROOT):
+        self.checkpoint_dir = checkpoint_dir
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, content, num_questions, additional_note, fresh=False, **kwargs):
+        # Returns (job, started); started is False when the call joined an identical job already running.
+        # A fresh request drops the checkpoint, so it is refused while an identical job is still writing to it.
+        # A cancelled job stays registered until its in-flight chunks have settled, and any request for it is
+        # refused until then, so two runs never write or remove the same checkpoint
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and (fresh or job.cancel_event.is_set()):
+                raise GenerationJobRunning(f"Generation job {job_id} is still running")
+            if job is not None:
+                job.waiters += 1
+                metrics.increment("jobs_joined")
+                return job, False
+            job = GenerationJob(job_id, JobCheckpoint(job_id, self.checkpoint_dir))
+            self._jobs[job_id] = job
+
+        if fresh:
+            job.checkpoint.remove()
+        prune_checkpoints(self.checkpoint_dir)
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run, job, content, num_questions, additional_note, fresh, kwargs), daemon=True)
+        thread.start()
+        return job, True
+
+    def cancel(self, job):
+        # Detaches one waiter; the job itself only stops once nobody is following it any more
+        with self._lock:
+            job.waiters = max(0, job.waiters - 1)
+            if job.waiters:
+                return False
+            job.cancel_event.set()
+        return True
+
+    def _run(self, job, content, num_questions, additional_note, fresh, kwargs):
+        completed_chunks = job.checkpoint.load()
+        if completed_chunks:
+            logger.info("Resuming generation job %s with %s finished chunks", job.job_id, len(completed_chunks))
+        try:
+            result = generate_questions(content, num_questions, additional_note, fresh=fresh, on_question=job.add_question, token_report=job.token_report,
+                                        completed_chunks=completed_chunks, on_chunk_done=job.complete_chunk, cancel_event=job.cancel_event,
+                                        on_plan=lambda chunk_numbers: job.set_plan(chunk_numbers, completed_chunks), **kwargs)
+        except GenerationCancelled as e:
+            self._release(job)
+            job.finish("cancelled", error=e)
+        except Exception as e:
+            logger.exception("Generation job %s failed", job.job_id)
+            self._release(job)
+            job.finish("failed", error=e)
+        else:
+            # Every chunk response is in the response cache now, so the checkpoint has served its purpose
+            job.checkpoint.remove()
+            self._release(job)
+            job.finish("completed", result=result)
+
+    def _release(self, job):
+        # Finished jobs leave the registry; a later identical request resumes from the checkpoint or the response cache
+        with self._lock:
+            if self._jobs.get(job.job_id) is job:
+                del self._jobs[job.job_id]
+
+
+_registry = JobRegistry()
+
+
+def generation_job_key(content, num_questions, additional_note, starting_question_number=1, compression_ratio=1.0, sources=None):
+    counts = [num_questions.get(question_type, 0) for question_type in QUESTION_TYPES]
+    return make_cache_key(content, *counts, additional_note or "", starting_question_number, compression_ratio, *model_identity(), sources or [])
+
+
+def start_generation_job(content, num_questions, additional_note, max_concurrent_requests=MAX_CONCURRENT_REQUESTS, fresh=False, stream=True,
+                         api_key=None, starting_question_number=1, session_id="default", compression_ratio=1.0, sources=None):
+    # Starts generation in the background, or joins the identical job that is already running, and returns the job
+    job_id = generation_job_key(content, num_questions, additional_note, starting_question_number, compression_ratio, sources)
+    job, started = _registry.submit(job_id, content, num_questions, additional_note, fresh=fresh,
+                                    max_concurrent_requests=max_concurrent_requests, stream=stream, api_key=api_key,
+                                    starting_question_number=starting_question_number, session_id=session_id, compression_ratio=compression_ratio, sources=sources)
+    if not started:
+        logger.info("Joined running generation job %s shared by %s sessions", job_id, job.waiters)
+    return job
+
+
+def cancel_generation_job(job):
+    return _registry.cancel(job)
@@ -0,0 +1,165 @@
+"""Per-stage timing spans and counters for the generation pipeline.
+
+Nothing is recorded unless an Instrumentation is active for the current context:
+
+    instrumentation = Instrumentation()
+    with recording(instrumentation):
+        generate_questions(...)
+    print(instrumentation.to_prometheus())
+
+With no active recorder, span() hands back one shared no-op object, so instrumented code costs a
+context variable lookup per call.
+"""
+from contextvars import ContextVar
+import threading
+import time
+import json
+import math
+import re
+
+
+_active_instrumentation = ContextVar("study_quest_instrumentation", default=None)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, instrumentation, name, attributes):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self):
+        self._start_wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self._attributes["error"] = exc_type.__name__
+        self._instrumentation.add_span(self._name, time.perf_counter() - self._start, self._start_wall, **self._attributes)
+        return False
+
+    def __setitem__(self, key, value):
+        # Lets the instrumented block attach sizes and counts it only knows once it has run
+        self._attributes[key] = value
+
+
+class Instrumentation:
+    def __init__(self):
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        return _Span(self, name, attributes)
+
+    def add_span(self, name, duration, start=None, **attributes):
+        record = {"span": name, "start": time.time() - duration if start is None else start, "duration": duration, **attributes}
+        with self._lock:
+            self.spans.append(record)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        durations = {}
+        with self._lock:
+            for record in self.spans:
+                durations.setdefault(record["span"], []).append(record["duration"])
+        rows = []
+        for name, values in durations.items():
+            values.sort()
+            rows.append({
+                "span": name,
+                "count": len(values),
+                "total_seconds": sum(values),
+                "p50_seconds": values[max(0, math.ceil(0.50 * len(values)) - 1)],
+                "p95_seconds": values[max(0, math.ceil(0.95 * len(values)) - 1)],
+                "max_seconds": values[-1]
+            })
+        return rows
+
+    def to_json_lines(self):
+        with self._lock:
+            lines = [json.dumps(record, default=str) for record in self.spans]
+            lines.extend(json.dumps({"counter": name, "value": value}) for name, value in sorted(self.counters.items()))
+        return "\n".join(lines) + "\n"
+
+    def to_prometheus(self, prefix="study_quest"):
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds summary"
+        ]
+        for row in self.summary():
+            stage = _prometheus_label(row["span"])
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.5"}} {row["p50_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="0.95"}} {row["p95_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {row["total_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {row["count"]}')
+        with self._lock:
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            metric = f"{prefix}_{_prometheus_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+class recording:
+    """Context manager that makes an Instrumentation the active recorder for the current context."""
+
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    def __enter__(self):
+        self._token = _active_instrumentation.set(self.instrumentation)
+        return self.instrumentation
+
+    def __exit__(self, exc_type, exc, traceback):
+        _active_instrumentation.reset(self._token)
+        return False
+
+
+def active_instrumentation():
+    return _active_instrumentation.get()
+
+
+def span(name, **attributes):
+    instrumentation = _active_instrumentation.get()
+    if instrumentation is None:
+        return _NULL_SPAN
+    return instrumentation.span(name, **attributes)
+
+
+def add_span(name, duration, **attributes):
+    instrumentation = _active_instrumentation.get()
+    if instrumentation is not None:
+        instrumentation.add_span(name, duration, **attributes)
+
+
+def increment(name, value=1):
+    instrumentation = _active_instrumentation.get()
+    if instrumentation is not None:
+        instrumentation.increment(name, value)
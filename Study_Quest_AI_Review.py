@@ -0,0 +1,132 @@
+"""Spaced-repetition review built on the quiz's scoring history.
+
+Each scoring_history entry carries SM-2 state next to its times_wrong counter: ease, interval (days),
+repetitions and the time the question is due again. Entries only exist for questions with a result;
+the rest are treated as never reviewed. Every graded answer updates this state, in quiz and review mode
+alike. ReviewScheduler keeps every question in a heap ordered by due time, so picking the next k due
+questions costs O(k log n) regardless of the size of the bank. A sorted list of the due times answers how
+many are due with a binary search; keeping it sorted moves O(n) list items per answered question, a single
+memmove that stays well below a rescan of the scoring history even for large banks.
+"""
+import bisect
+import heapq
+import time
+
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+# A missed question comes back within the same study session instead of the next day
+RELEARN_DELAY = 10 * 60
+SECONDS_PER_DAY = 24 * 3600
+
+
+def answer_quality(correct, similarity=100.0):
+    # SM-2 grades recall 0-5; an exact answer is a perfect recall, a fuzzy-accepted one a hesitant recall
+    if not correct:
+        return 1
+    return 5 if similarity >= 100.0 else 4
+
+
+def initial_due(entry):
+    # Questions never reviewed are due now, the ones missed most in plain quizzes first
+    return -float(entry.get("times_wrong", 0))
+
+
+def update_review_state(entry, quality, now=None):
+    now = time.time() if now is None else now
+    ease = entry.get("ease", DEFAULT_EASE)
+    interval = entry.get("interval", 0)
+    repetitions = entry.get("repetitions", 0)
+
+    if quality >= 3:
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = round(interval * ease)
+        repetitions += 1
+        due = now + interval * SECONDS_PER_DAY
+    else:
+        repetitions = 0
+        interval = 0
+        due = now + RELEARN_DELAY
+
+    entry["ease"] = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    entry["interval"] = interval
+    entry["repetitions"] = repetitions
+    entry["due"] = due
+    entry["times_reviewed"] = entry.get("times_reviewed", 0) + 1
+    return entry
+
+
+class ReviewScheduler:
+    """Min-heap of (due time, question index) over a bank of question_count questions and its scoring_history dict.
+
+    Updated entries are pushed again rather than re-positioned; the outdated heap items are skipped when
+    they surface and the heap is rebuilt once they outnumber the live ones.
+    """
+
+    def __init__(self, scoring_history, question_count):
+        self.scoring_history = scoring_history
+        self.question_count = question_count
+        self._due = {}
+        for idx in range(question_count):
+            entry = self._entry(idx) or {}
+            self._due[idx] = entry.get("due", initial_due(entry))
+        self._heap = [(due, idx) for idx, due in self._due.items()]
+        heapq.heapify(self._heap)
+        self._due_times = sorted(self._due.values())
+
+    def __len__(self):
+        return len(self._due)
+
+    def _entry(self, idx):
+        entry = self.scoring_history.get(idx)
+        return self.scoring_history.get(str(idx)) if entry is None else entry
+
+    def due_questions(self, limit, now=None):
+        # Up to limit question indexes that are due, most overdue first; they stay scheduled until reviewed
+        now = time.time() if now is None else now
+        taken = []
+        while self._heap and len(taken) < limit:
+            due, idx = heapq.heappop(self._heap)
+            if self._due.get(idx) != due:
+                continue  # Superseded by a later update
+            if due > now:
+                heapq.heappush(self._heap, (due, idx))
+                break
+            taken.append((due, idx))
+        for item in taken:
+            heapq.heappush(self._heap, item)
+        return [idx for _, idx in taken]
+
+    def next_due_time(self):
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def due_count(self, now=None):
+        now = time.time() if now is None else now
+        return bisect.bisect_right(self._due_times, now)
+
+    def record(self, idx, quality, now=None):
+        if not 0 <= idx < self.question_count:
+            return None
+        entry = self._entry(idx)
+        if entry is None:
+            entry = self.scoring_history[idx] = {"times_wrong": 0}
+        update_review_state(entry, quality, now)
+        del self._due_times[bisect.bisect_left(self._due_times, self._due[idx])]
+        bisect.insort(self._due_times, entry["due"])
+        self._due[idx] = entry["due"]
+        heapq.heappush(self._heap, (entry["due"], idx))
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(due, idx) for idx, due in self._due.items()]
+            heapq.heapify(self._heap)
+        return entry
+
+    def record_graded(self, graded, now=None):
+        # graded is a frame from Study_Quest_AI_Grading.grade_attempt
+        for idx, correct, similarity in zip(graded["question_index"], graded["correct"], graded["similarity"]):
+            self.record(int(idx), answer_quality(correct, similarity), now)
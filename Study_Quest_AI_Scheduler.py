@@ -0,0 +1,172 @@
+"""Process-wide pacing for model requests.
+
+Every request from every Streamlit session goes through one RequestScheduler. It holds token buckets for
+requests per minute and tokens per minute, hands out turns round-robin across sessions so one large
+document cannot starve everyone else, and retries rate-limit and server errors with jittered exponential
+backoff. A 429 pauses all sessions, not only the one that hit it, so the process backs off as a whole.
+"""
+from collections import deque
+import Study_Quest_AI_Metrics as metrics
+import threading
+import logging
+import random
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# Defaults match the Gemini 1.5 Flash pay-as-you-go quota; lower them for the free tier
+REQUESTS_PER_MINUTE = float(os.getenv("STUDY_QUEST_REQUESTS_PER_MINUTE", "1000"))
+TOKENS_PER_MINUTE = float(os.getenv("STUDY_QUEST_TOKENS_PER_MINUTE", "4000000"))
+MAX_RETRIES = 5
+BASE_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded"}
+
+
+def error_status_code(error):
+    # google.api_core exceptions carry the HTTP status in .code, requests' HTTPError in .response.status_code
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code
+    return None
+
+
+def is_retryable_error(error):
+    return error_status_code(error) in RETRYABLE_STATUS_CODES or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute if capacity is None else capacity
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)  # A request larger than the bucket waits for a full bucket instead of forever
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        # May go negative when a response turns out larger than estimated; later callers then wait it off
+        self.tokens -= amount
+
+
+class RequestScheduler:
+    """Token-bucket pacing, round-robin fairness across sessions and retry with backoff.
+
+    Not thread-bound; callers on any thread block in acquire() until their turn and the quota allow it.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, max_retries=MAX_RETRIES,
+                 base_delay=BASE_RETRY_DELAY, max_delay=MAX_RETRY_DELAY):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        self._waiting = {}
+        self._turns = deque()
+        self._paused_until = 0.0
+
+    def acquire(self, session_id, tokens):
+        with self._condition:
+            ticket = object()
+            waiting = self._waiting.setdefault(session_id, deque())
+            waiting.append(ticket)
+            if len(waiting) == 1:
+                self._turns.append(session_id)
+
+            while True:
+                if self._turns[0] == session_id and waiting[0] is ticket:
+                    now = time.monotonic()
+                    wait = max(self._paused_until - now, self.request_bucket.wait_time(1, now), self.token_bucket.wait_time(tokens, now))
+                    if wait <= 0:
+                        self.request_bucket.consume(1)
+                        self.token_bucket.consume(tokens)
+                        waiting.popleft()
+                        # Served sessions go to the back of the line, so every waiting session gets a turn per round
+                        self._turns.popleft()
+                        if waiting:
+                            self._turns.append(session_id)
+                        else:
+                            del self._waiting[session_id]
+                        self._condition.notify_all()
+                        return
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def charge_tokens(self, tokens):
+        # Settle the difference once the real usage of a request is known
+        with self._condition:
+            self.token_bucket.consume(tokens)
+
+    def pause(self, seconds):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def backoff_delay(self, attempt):
+        # Full jitter keeps retries from many sessions from landing in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, function, *args, session_id="default", estimated_tokens=0, **kwargs):
+        attempt = 0
+        while True:
+            wait_start = time.perf_counter()
+            self.acquire(session_id, estimated_tokens)
+            metrics.add_span("queue_wait", time.perf_counter() - wait_start, session=session_id)
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                metrics.increment("backoff_retries")
+                logger.warning("Retryable model error (%s), retrying in %.1fs (attempt %s of %s)", e, delay, attempt, self.max_retries)
+                if error_status_code(e) == 429:
+                    self.pause(delay)  # Quota is shared, so every session waits out a rate limit
+                else:
+                    time.sleep(delay)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    global _scheduler
+    with _scheduler_lock:
+        previous_scheduler = _scheduler
+        _scheduler = scheduler
+        return previous_scheduler
@@ -0,0 +1,225 @@
+"""Local SQLite store for question banks and their scoring history.
+
+Every question is one row, holding its scoring-history and review state next to it, so an edit or a
+graded answer is a single-row upsert instead of rewriting the whole bank. Rows are indexed by source
+document and question type within a bank, so the quiz's filtered pages are read with indexed queries
+instead of by filtering the bank in memory.
+"""
+from Study_Quest_AI_Bank import Question, QuestionBank
+from Study_Quest_AI_Cache import CACHE_ROOT
+import threading
+import sqlite3
+import json
+import time
+import os
+
+
+STORE_PATH = os.getenv("STUDY_QUEST_STORE_PATH", os.path.join(CACHE_ROOT, "question_bank.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS banks (
+    bank_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT
+);
+CREATE TABLE IF NOT EXISTS questions (
+    bank_id TEXT NOT NULL REFERENCES banks(bank_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    source TEXT,
+    type_of_test TEXT NOT NULL,
+    question TEXT NOT NULL,
+    choices TEXT,
+    answer TEXT NOT NULL,
+    question_number TEXT,
+    times_wrong INTEGER NOT NULL DEFAULT 0,
+    ease REAL,
+    interval INTEGER,
+    repetitions INTEGER,
+    due REAL,
+    times_reviewed INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (bank_id, position)
+);
+CREATE INDEX IF NOT EXISTS questions_by_source ON questions (bank_id, source, position);
+CREATE INDEX IF NOT EXISTS questions_by_type ON questions (bank_id, type_of_test, position);
+CREATE INDEX IF NOT EXISTS questions_by_due ON questions (bank_id, due);
+"""
+
+QUESTION_COLUMNS = "position, source, type_of_test, question, choices, answer, question_number"
+HISTORY_FIELDS = ["times_wrong", "ease", "interval", "repetitions", "due", "times_reviewed"]
+
+
+def question_row(bank_id, position, question, source=None, history_entry=None, now=None):
+    history_entry = history_entry or {}
+    return (
+        bank_id, position, question.get("source", source), question["type_of_test"], question["question"],
+        json.dumps(question["choices"], ensure_ascii=False) if "choices" in question else None,
+        json.dumps(question["answer"], ensure_ascii=False), question.get("question_number"),
+        history_entry.get("times_wrong", 0), history_entry.get("ease"), history_entry.get("interval"), history_entry.get("repetitions"),
+        history_entry.get("due"), history_entry.get("times_reviewed", 0), time.time() if now is None else now
+    )
+
+
+def row_question(row):
+    position, source, type_of_test, question_text, choices, answer, question_number = row
+    return position, Question(question_text, type_of_test, json.loads(answer), None if choices is None else json.loads(choices), question_number, source)
+
+
+class QuestionStore:
+    """Thread-safe access to one SQLite file; Streamlit reruns and background jobs share a single connection."""
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(SCHEMA)
+            if "owner" not in {column[1] for column in self._connection.execute("PRAGMA table_info(banks)")}:
+                # Banks saved before they had owners are not listed for anyone
+                self._connection.execute("ALTER TABLE banks ADD COLUMN owner TEXT")
+
+    def _filters(self, bank_id, type_of_test=None, source=None):
+        clauses = ["bank_id = ?"]
+        parameters = [bank_id]
+        if type_of_test is not None:
+            clauses.append("type_of_test = ?")
+            parameters.append(type_of_test)
+        if source is not None:
+            clauses.append("source = ?")
+            parameters.append(source)
+        return " AND ".join(clauses), parameters
+
+    def create_bank(self, bank_id, name, owner=None):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR IGNORE INTO banks (bank_id, name, created, updated, owner) VALUES (?, ?, ?, ?, ?)", (bank_id, name, now, now, owner))
+
+    def list_banks(self, owner):
+        with self._lock:
+            return self._connection.execute("""
+                SELECT banks.bank_id, banks.name, banks.updated, COUNT(questions.position)
+                FROM banks LEFT JOIN questions ON questions.bank_id = banks.bank_id
+                WHERE banks.owner = ?
+                GROUP BY banks.bank_id ORDER BY banks.updated DESC
+            """, (owner,)).fetchall()
+
+    def delete_bank(self, bank_id, owner):
+        # Returns False when the bank does not exist or belongs to someone else
+        with self._lock, self._connection:
+            return self._connection.execute("DELETE FROM banks WHERE bank_id = ? AND owner = ?", (bank_id, owner)).rowcount > 0
+
+    def add_questions(self, bank_id, questions, source=None, scoring_history=None, start_position=None):
+        # Appends after the bank's last position unless start_position is given; returns the first position used
+        scoring_history = scoring_history or {}
+        now = time.time()
+        with self._lock, self._connection:
+            if start_position is None:
+                start_position = self._connection.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM questions WHERE bank_id = ?", (bank_id,)).fetchone()[0]
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (question_row(bank_id, start_position + offset, question, source, scoring_history.get(offset), now) for offset, question in enumerate(questions))
+            )
+            self._connection.execute("UPDATE banks SET updated = ? WHERE bank_id = ?", (now, bank_id))
+        return start_position
+
+    def replace_bank(self, bank_id, questions, source=None, scoring_history=None):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM questions WHERE bank_id = ?", (bank_id,))
+        return self.add_questions(bank_id, questions, source, scoring_history, start_position=0)
+
+    def truncate_bank(self, bank_id, length):
+        # Drops every question from position length on
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM questions WHERE bank_id = ? AND position >= ?", (bank_id, length))
+
+    def upsert_question(self, bank_id, position, question):
+        # Updates the question's content and keeps its scoring history
+        now = time.time()
+        row = question_row(bank_id, position, question, now=now)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                INSERT INTO questions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bank_id, position) DO UPDATE SET
+                    source = COALESCE(excluded.source, questions.source), type_of_test = excluded.type_of_test, question = excluded.question,
+                    choices = excluded.choices, answer = excluded.answer, question_number = excluded.question_number, updated = excluded.updated
+            """, row)
+            self._connection.execute("UPDATE banks SET updated = ? WHERE bank_id = ?", (now, bank_id))
+
+    def update_history(self, bank_id, entries):
+        # entries maps positions to scoring_history entries; only the given rows are written
+        now = time.time()
+        rows = [(*(entry.get(field) for field in HISTORY_FIELDS), now, bank_id, int(position)) for position, entry in entries.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(f"""
+                UPDATE questions SET {", ".join(f"{field} = COALESCE(?, {field})" for field in HISTORY_FIELDS)}, updated = ?
+                WHERE bank_id = ? AND position = ?
+            """, rows)
+            self._connection.execute("UPDATE banks SET updated = ? WHERE bank_id = ?", (now, bank_id))
+
+    def count(self, bank_id, type_of_test=None, source=None):
+        where, parameters = self._filters(bank_id, type_of_test, source)
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM questions WHERE {where}", parameters).fetchone()[0]
+
+    def sources(self, bank_id):
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT DISTINCT source FROM questions WHERE bank_id = ? AND source IS NOT NULL ORDER BY source", (bank_id,))]
+
+    def page_positions(self, bank_id, offset, limit, type_of_test=None, source=None):
+        where, parameters = self._filters(bank_id, type_of_test, source)
+        with self._lock:
+            rows = self._connection.execute(f"SELECT position FROM questions WHERE {where} ORDER BY position LIMIT ? OFFSET ?", (*parameters, limit, offset)).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_bank(self, bank_id, batch_size=500):
+        # Yields (position, question, history entry) in bank order without holding the whole bank in memory
+        last_position = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(f"""
+                    SELECT {QUESTION_COLUMNS}, {", ".join(HISTORY_FIELDS)} FROM questions
+                    WHERE bank_id = ? AND position > ? ORDER BY position LIMIT ?
+                """, (bank_id, last_position, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                position, question = row_question(row[:7])
+                history_entry = {field: value for field, value in zip(HISTORY_FIELDS, row[7:]) if value is not None}
+                yield position, question, history_entry
+            last_position = rows[-1][0]
+
+    def load_history(self, bank_id):
+        # Scoring history of the questions that have any, keyed by position
+        with self._lock:
+            rows = self._connection.execute(f"""
+                SELECT position, {", ".join(HISTORY_FIELDS)} FROM questions
+                WHERE bank_id = ? AND (times_wrong > 0 OR times_reviewed > 0 OR due IS NOT NULL)
+            """, (bank_id,)).fetchall()
+        return {row[0]: {field: value for field, value in zip(HISTORY_FIELDS, row[1:]) if value is not None} for row in rows}
+
+    def load_bank(self, bank_id):
+        # The bank as the app's all_questions list and scoring_history dict
+        questions = QuestionBank(question for _, question, _ in self.iter_bank(bank_id))
+        return questions, self.load_history(bank_id)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_question_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = QuestionStore()
+        return _store